@@ -0,0 +1,49 @@
+from sqlalchemy import event, or_
+from .models import MasterProjectModel
+from .migrations import skip_modified_touch
+
+
+CLOSED_STAGES = ("Won", "Lost")
+
+
+def is_closed(stage):
+    return stage in CLOSED_STAGES
+
+
+@event.listens_for(MasterProjectModel, 'before_insert')
+@event.listens_for(MasterProjectModel, 'before_update')
+def set_archived(mapper, connection, target):
+    # reopening a Won/Lost project moves it back into the live partition
+    target.archived = is_closed(target.project_status)
+
+
+def live(query):
+    return query.filter(MasterProjectModel.archived.is_(False))
+
+
+def archived(query):
+    return query.filter(MasterProjectModel.archived.is_(True))
+
+
+def for_stage(query, stage):
+    # keeps the archived flag in the WHERE clause so the planner can use the partial indexes
+    query = query.filter(MasterProjectModel.project_status == stage)
+    return archived(query) if is_closed(stage) else live(query)
+
+
+def archive_closed_projects(session):
+    # backfill for rows written before the flag existed, later writes are kept in sync by set_archived
+    # the archived flag is not in the ES document, keep the backfill out of the delta reindex
+    skip_modified_touch(session)
+    closed = MasterProjectModel.project_status.in_(CLOSED_STAGES)
+    archived_count = session.query(MasterProjectModel).filter(
+        closed, MasterProjectModel.archived.isnot(True)
+    ).update({MasterProjectModel.archived: True}, synchronize_session=False)
+    restored_count = session.query(MasterProjectModel).filter(
+        or_(~closed, MasterProjectModel.project_status.is_(None)), MasterProjectModel.archived.isnot(False)
+    ).update({MasterProjectModel.archived: False}, synchronize_session=False)
+    return archived_count, restored_count
+
+
+def count_live_projects(session):
+    return live(session.query(MasterProjectModel.id)).count()
@@ -0,0 +1,76 @@
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from graphql.execution.executors.asyncio import AsyncioExecutor
+from .cost import FIELD_WEIGHTS
+from .routing import with_routing
+
+
+# resolvers that block on a DB or ES round trip, everything else is a plain attribute read
+# and is cheaper to run inline than to hop to a thread. the same fields cost.py weighs as DB bound
+def blocking_resolvers(weights=FIELD_WEIGHTS):
+    resolvers = {}
+    for type_name, field_name in weights:
+        resolvers.setdefault(type_name, set()).add(field_name)
+    return resolvers
+
+
+BLOCKING_RESOLVERS = blocking_resolvers()
+
+# keep this at or below the sqlalchemy pool size, every worker holds a connection while it runs
+MAX_WORKERS = 10
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="project-resolver")
+    return _pool
+
+
+class ThreadedResolverMiddleware(object):
+    def __init__(self, resolvers=BLOCKING_RESOLVERS, pool=None, offload_root=True):
+        self.resolvers = resolvers
+        self.pool = pool
+        self.offload_root = offload_root
+
+    def is_blocking(self, info):
+        type_name = info.parent_type.name
+        if info.field_name in self.resolvers.get(type_name, ()):
+            return True
+        # root query/mutation fields (MasterProject.detail, MasterProjectWithCount.all, ...) all hit the DB
+        return self.offload_root and type_name in (
+            info.schema.get_query_type().name,
+            getattr(info.schema.get_mutation_type(), 'name', None)
+        )
+
+    def resolve(self, next, root, info, **args):
+        if not self.is_blocking(info):
+            return next(root, info, **args)
+        loop = asyncio.get_event_loop()
+        # carry the request's session route (see routing.py) into the worker thread
+        ctx = contextvars.copy_context()
+        return loop.run_in_executor(self.pool or get_pool(), ctx.run, functools.partial(next, root, info, **args))
+
+
+async def execute_async(schema, request_string, loop=None, middleware=None, **kwargs):
+    loop = loop or asyncio.get_event_loop()
+    middleware = with_routing(list(middleware or []) + [ThreadedResolverMiddleware()])
+    return await schema.execute(
+        request_string,
+        executor=AsyncioExecutor(loop=loop),
+        return_promise=True,
+        middleware=middleware,
+        **kwargs
+    )
+
+
+def execute(schema, request_string, **kwargs):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(execute_async(schema, request_string, loop=loop, **kwargs))
+    finally:
+        loop.close()
@@ -0,0 +1,122 @@
+from collections import namedtuple
+from elasticsearch import helpers
+from utils.db import get_session
+from utils.es_conn import es
+from clients.models import ClientMasterModel
+from auth.models import UserModel
+from .serializers import build_project_doc, index_all_projects, iter_with_relations, project_keyword_doc
+from .delta_index import remove_project_docs
+from .models import MasterProjectModel
+
+
+BATCH_SIZE = 500
+
+ConsistencyReport = namedtuple('ConsistencyReport', [
+    'checked', 'missing', 'stale', 'orphaned', 'keyword_missing', 'keyword_stale', 'keyword_orphaned'
+])
+
+
+def load_lookups(session):
+    clients = {c.id: c.name for c in session.query(ClientMasterModel).all()}
+    users = {u.id: u.name for u in session.query(UserModel).all()}
+    return clients, users
+
+
+def iter_db_docs(session, ids=None, batch_size=BATCH_SIZE):
+    clients, users = load_lookups(session)
+    if ids is None:
+        ids = [pid for pid, in session.query(MasterProjectModel.id).order_by(MasterProjectModel.id)]
+    for i in range(0, len(ids), batch_size):
+        projects = session.query(MasterProjectModel).filter(
+            MasterProjectModel.id.in_(ids[i:i + batch_size])
+        ).order_by(MasterProjectModel.id).all()
+        # attributes, directors and members come in one query each for the whole batch
+        for project, relations in iter_with_relations(session, projects, batch_size):
+            yield project.id, build_project_doc(session, project, clients, users, relations)
+        # keep the identity map from holding every project at once
+        session.expunge_all()
+
+
+def iter_es_fingerprints():
+    query = {"_source": ["fingerprint"], "query": {"match_all": {}}}
+    for hit in helpers.scan(es, index='project', doc_type='project', query=query, size=1000):
+        yield int(hit['_id']), hit['_source'].get('fingerprint')
+
+
+def iter_es_keywords():
+    query = {"_source": ["keyword"], "query": {"term": {"keyword_type": "project"}}}
+    for hit in helpers.scan(es, index='keyword', doc_type='keyword', query=query, size=1000):
+        yield int(hit['_id'][len("project_"):]), hit['_source'].get('keyword')
+
+
+def check_consistency(session):
+    indexed = dict(iter_es_fingerprints())
+    keywords = dict(iter_es_keywords())
+    checked, missing, stale, keyword_missing, keyword_stale = 0, [], [], [], []
+    for project_id, doc in iter_db_docs(session):
+        checked += 1
+        if project_id not in indexed:
+            missing.append(project_id)
+        # docs written before fingerprints existed have none and count as stale
+        elif indexed.pop(project_id) != doc["fingerprint"]:
+            stale.append(project_id)
+        if project_id not in keywords:
+            keyword_missing.append(project_id)
+        elif keywords.pop(project_id) != doc["project_title"]:
+            keyword_stale.append(project_id)
+    return ConsistencyReport(
+        checked, missing, stale, sorted(indexed), keyword_missing, keyword_stale, sorted(keywords)
+    )
+
+
+def repair_keywords(session, ids):
+    actions = []
+    for project_id, doc in iter_db_docs(session, ids):
+        action = project_keyword_doc(doc)
+        action.update({'_index': 'keyword', '_type': 'keyword', '_id': "project_{}".format(project_id)})
+        actions.append(action)
+    written, _ = helpers.bulk(es, actions, chunk_size=1000, request_timeout=200)
+    return written
+
+
+def remove_keyword_docs(project_ids):
+    actions = [
+        {'_op_type': 'delete', '_index': 'keyword', '_type': 'keyword', '_id': "project_{}".format(project_id)}
+        for project_id in project_ids
+    ]
+    deleted, _ = helpers.bulk(es, actions, chunk_size=1000, request_timeout=200, raise_on_error=False)
+    return deleted
+
+
+def repair(session, report, batch_size=BATCH_SIZE):
+    ids = report.missing + report.stale
+    for i in range(0, len(ids), batch_size):
+        projects = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids[i:i + batch_size])).all()
+        if projects:
+            index_all_projects(projects, keep_index=True)
+    # reindexed projects got their keyword doc with them
+    rewritten = set(ids)
+    keyword_ids = [pid for pid in report.keyword_missing + report.keyword_stale if pid not in rewritten]
+    if keyword_ids:
+        repair_keywords(session, keyword_ids)
+    orphaned = set(report.orphaned)
+    remove_keyword_docs([pid for pid in report.keyword_orphaned if pid not in orphaned])
+    return remove_project_docs(report.orphaned)
+
+
+def verify_index(fix=True):
+    session = get_session()
+    report = check_consistency(session)
+    print("checked {}: {} missing, {} stale, {} orphaned, keywords {} missing, {} stale, {} orphaned".format(
+        report.checked, len(report.missing), len(report.stale), len(report.orphaned),
+        len(report.keyword_missing), len(report.keyword_stale), len(report.keyword_orphaned)
+    ))
+    if fix and any(report[1:]):
+        repair(session, report)
+    session.close()
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    verify_index(fix="--dry-run" not in sys.argv)
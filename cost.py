@@ -0,0 +1,209 @@
+import copy
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.language.parser import parse
+from graphql.type import GraphQLList, GraphQLNonNull
+from graphql.validation import validate
+
+
+MAX_COST = 5000
+# size assumed for list fields that have no start/end arguments, e.g. MasterProject.members
+DEFAULT_LIST_SIZE = 10
+# largest page a single list field may ask for when truncating
+MAX_PAGE_SIZE = 100
+
+# extra weight for fields whose resolver does a DB or ES round trip, plain attributes cost 1. keyed by
+# schema (camelCase) field name. also the list of resolvers async_execution.py runs on worker threads
+FIELD_WEIGHTS = {
+    ('MasterProject', 'location'): 2,
+    ('MasterProject', 'client'): 2,
+    ('MasterProject', 'createdBy'): 2,
+    ('MasterProject', 'expertise'): 2,
+    ('MasterProject', 'sectors'): 2,
+    ('MasterProject', 'stakeholders'): 2,
+    ('MasterProject', 'members'): 2,
+    ('MasterProject', 'directors'): 2,
+    ('MasterProject', 'candidates'): 2,
+    ('MasterProject', 'candidateCounts'): 2,
+    ('MasterProject', 'totalCandidates'): 2,
+    ('MasterProject', 'hiringStages'): 2,
+    ('MasterProject', 'noteList'): 2,
+    ('MasterProject', 'noteFeed'): 2,
+    ('ProjectSmall', 'clientName'): 2,
+    ('ProjectSmall', 'expertise'): 2,
+    ('ProjectSmall', 'sectors'): 2,
+    ('ProjectSmall', 'hiringStages'): 2,
+    ('ProjectCandidate', 'freelancer'): 5,
+    ('ProjectCandidate', 'project'): 2,
+    ('ProjectNote', 'createdBy'): 2,
+    ('ResourcingConstants', 'segments'): 2,
+    ('ResourcingConstants', 'subSegments'): 2,
+    ('ResourcingConstants', 'ratingCriterias'): 2,
+}
+
+
+class QueryCostError(GraphQLError):
+    def __init__(self, message, cost):
+        super(QueryCostError, self).__init__(message)
+        self.cost = cost
+
+
+def unwrap(graphql_type):
+    is_list = False
+    while isinstance(graphql_type, (GraphQLList, GraphQLNonNull)):
+        if isinstance(graphql_type, GraphQLList):
+            is_list = True
+        graphql_type = graphql_type.of_type
+    return graphql_type, is_list
+
+
+class CostAnalyzer(object):
+    def __init__(self, schema, max_cost=MAX_COST, default_list_size=DEFAULT_LIST_SIZE, weights=FIELD_WEIGHTS,
+                 truncate=False, max_page_size=MAX_PAGE_SIZE):
+        self.schema = schema
+        self.max_cost = max_cost
+        self.default_list_size = default_list_size
+        self.weights = weights
+        self.truncate = truncate
+        self.max_page_size = max_page_size
+
+    def arg_value(self, node, variables):
+        if isinstance(node, ast.Variable):
+            return variables.get(node.name.value)
+        if isinstance(node, ast.IntValue):
+            return int(node.value)
+        return getattr(node, 'value', None)
+
+    def page_size(self, field_def, field_node, variables):
+        if 'start' not in field_def.args and 'end' not in field_def.args:
+            return None
+        values = {name: arg.default_value for name, arg in field_def.args.items()}
+        nodes = {a.name.value: a for a in field_node.arguments or []}
+        for name in ('start', 'end'):
+            if name in nodes:
+                values[name] = self.arg_value(nodes[name].value, variables)
+        start = values.get('start') or 0
+        end = values.get('end')
+        if end is None:
+            return None
+        size = max(end - start + 1, 0)
+        if self.truncate and size > self.max_page_size:
+            # end is inclusive in this schema (see MasterProject.resolve_candidates)
+            self.clamp_end(field_node, nodes, variables, start + self.max_page_size - 1)
+            size = self.max_page_size
+        return size
+
+    def clamp_end(self, field_node, nodes, variables, end):
+        node = nodes.get('end')
+        if node is None:
+            field_node.arguments = list(field_node.arguments or []) + [
+                ast.Argument(name=ast.Name(value='end'), value=ast.IntValue(value=str(end)))
+            ]
+        elif isinstance(node.value, ast.Variable):
+            # a variable can be shared by several fields, give this field its own literal instead
+            node.value = ast.IntValue(value=str(end))
+        else:
+            node.value.value = str(end)
+
+    def selection_cost(self, parent_type, selection_set, variables, fragments, inherited_size=None, visited=()):
+        total = 0
+        for selection in selection_set.selections if selection_set else []:
+            if isinstance(selection, ast.Field):
+                total += self.field_cost(parent_type, selection, variables, fragments, inherited_size, visited)
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                total += self.selection_cost(
+                    fragment_type, selection.selection_set, variables, fragments, inherited_size, visited
+                )
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                fragment = fragments.get(name)
+                if fragment is None or name in visited:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                total += self.selection_cost(
+                    fragment_type, fragment.selection_set, variables, fragments, inherited_size, visited + (name,)
+                )
+        return total
+
+    def field_cost(self, parent_type, node, variables, fragments, inherited_size, visited):
+        name = node.name.value
+        if name.startswith('__'):
+            return 0
+        fields = getattr(parent_type, 'fields', None) or {}
+        field_def = fields.get(name)
+        if field_def is None:
+            return 0
+        field_type, is_list = unwrap(field_def.type)
+        own_size = self.page_size(field_def, node, variables)
+        weight = self.weights.get((parent_type.name, name), 1)
+
+        multiplier = 1
+        pass_down = None
+        if is_list:
+            multiplier = own_size or inherited_size or self.default_list_size
+        elif own_size:
+            # paginated wrapper object like MasterProjectWithCount, its list children get the page size
+            pass_down = own_size
+
+        child = 0
+        if node.selection_set:
+            child = self.selection_cost(field_type, node.selection_set, variables, fragments, pass_down, visited)
+        return multiplier * (weight + child)
+
+    def analyze(self, document_ast, variables=None, operation_name=None):
+        variables = variables or {}
+        fragments = {}
+        operations = []
+        for definition in document_ast.definitions:
+            if isinstance(definition, ast.FragmentDefinition):
+                fragments[definition.name.value] = definition
+            elif isinstance(definition, ast.OperationDefinition):
+                operations.append(definition)
+        if operation_name:
+            operations = [o for o in operations if o.name and o.name.value == operation_name]
+        if not operations:
+            return 0
+        operation = operations[0]
+        root = self.schema.get_mutation_type() if operation.operation == 'mutation' else self.schema.get_query_type()
+        return self.selection_cost(root, operation.selection_set, variables, fragments)
+
+    def check(self, document_ast, variables=None, operation_name=None):
+        if self.truncate:
+            document_ast = copy.deepcopy(document_ast)
+        cost = self.analyze(document_ast, variables, operation_name)
+        if cost > self.max_cost:
+            raise QueryCostError("Query cost {} exceeds the limit of {}".format(cost, self.max_cost), cost)
+        return document_ast, cost
+
+
+def execute_with_cost(schema, document, analyzer=None, variables=None, operation_name=None, **kwargs):
+    analyzer = analyzer or CostAnalyzer(schema)
+    try:
+        document_ast = parse(document) if isinstance(document, str) else document
+        errors = validate(schema, document_ast)
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True)
+    except GraphQLError as e:
+        return ExecutionResult(errors=[e], invalid=True)
+    return execute_checked(schema, document_ast, analyzer, variables, operation_name, **kwargs)
+
+
+def cost_extension(cost, analyzer):
+    return {"cost": {"requested": cost, "limit": analyzer.max_cost, "truncated": analyzer.truncate}}
+
+
+def execute_checked(schema, document_ast, analyzer, variables=None, operation_name=None, **kwargs):
+    # document_ast must already be validated
+    try:
+        document_ast, cost = analyzer.check(document_ast, variables, operation_name)
+    except QueryCostError as e:
+        return ExecutionResult(errors=[e], invalid=True, extensions=cost_extension(e.cost, analyzer))
+    from .routing import with_routing
+    kwargs['middleware'] = with_routing(kwargs.get('middleware'))
+    result = execute(schema, document_ast, variables=variables or {}, operation_name=operation_name, **kwargs)
+    result.extensions = dict(result.extensions or {}, **cost_extension(cost, analyzer))
+    return result
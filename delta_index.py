@@ -0,0 +1,96 @@
+import datetime
+from sqlalchemy import text
+from elasticsearch import helpers
+from utils.db import get_session
+from utils.es_conn import es
+from .serializers import index_all_projects
+from .models import MasterProjectModel, ProjectTombstoneModel, IndexWatermarkModel
+
+
+WATERMARK = 'project_index'
+# modified_at is the writing transaction's start time, so a slow transaction can commit rows older
+# than a watermark that was already taken. re-reading this much history makes that safe, an extra
+# reindex of a handful of projects is harmless
+SAFETY_WINDOW = datetime.timedelta(minutes=5)
+TOMBSTONE_TTL = datetime.timedelta(days=30)
+BATCH_SIZE = 500
+
+
+def get_watermark(session):
+    row = session.query(IndexWatermarkModel).filter_by(name=WATERMARK).scalar()
+    return row.value if row else None
+
+
+def set_watermark(session, value):
+    row = session.query(IndexWatermarkModel).filter_by(name=WATERMARK).scalar()
+    if row is None:
+        session.add(IndexWatermarkModel(name=WATERMARK, value=value))
+    else:
+        row.value = value
+    session.flush()
+
+
+def db_now(session):
+    # same clock the modified_at / tombstone triggers use
+    return session.execute(text("SELECT timezone('utc', now())")).scalar()
+
+
+def changed_project_ids(session, since):
+    # candidate, note, attribute, member and director writes bump the parent's modified_at (migrations.TRIGGERS)
+    query = session.query(MasterProjectModel.id)
+    if since is not None:
+        query = query.filter(MasterProjectModel.modified_at > since)
+    return [pid for pid, in query.order_by(MasterProjectModel.id)]
+
+
+def deleted_project_ids(session, since):
+    query = session.query(ProjectTombstoneModel.project_id)
+    if since is not None:
+        query = query.filter(ProjectTombstoneModel.deleted_at > since)
+    return [pid for pid, in query]
+
+
+def remove_project_docs(project_ids):
+    actions = []
+    for project_id in project_ids:
+        actions.append({'_op_type': 'delete', '_index': 'project', '_type': 'project', '_id': project_id})
+        actions.append({
+            '_op_type': 'delete', '_index': 'keyword', '_type': 'keyword', '_id': "project_{}".format(project_id)
+        })
+    if not actions:
+        return 0
+    # a doc that is already gone is a 404, which is fine here
+    deleted, _ = helpers.bulk(es, actions, chunk_size=1000, request_timeout=200, raise_on_error=False)
+    return deleted
+
+
+def delta_reindex(full=False):
+    session = get_session()
+    started_at = db_now(session)
+    watermark = None if full else get_watermark(session)
+    since = watermark - SAFETY_WINDOW if watermark else None
+
+    changed = changed_project_ids(session, since)
+    deleted = deleted_project_ids(session, since)
+    for i in range(0, len(changed), BATCH_SIZE):
+        projects = session.query(MasterProjectModel).filter(
+            MasterProjectModel.id.in_(changed[i:i + BATCH_SIZE])
+        ).all()
+        # projects deleted since the ids were read drop out here and are tombstoned for the next run
+        if projects:
+            index_all_projects(projects, keep_index=True)
+    removed = remove_project_docs(deleted)
+
+    set_watermark(session, started_at)
+    session.query(ProjectTombstoneModel).filter(
+        ProjectTombstoneModel.deleted_at < started_at - TOMBSTONE_TTL
+    ).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+    print("delta reindex since {}: {} indexed, {} removed".format(since, len(changed), removed))
+    return changed, deleted
+
+
+if __name__ == "__main__":
+    import sys
+    delta_reindex(full="--full" in sys.argv)
@@ -0,0 +1,120 @@
+import io
+import csv
+import json
+import datetime
+from sqlalchemy import func
+from utils.exceptions import InvalidRequest
+from auth.models import UserModel
+from clients.models import ClientMasterModel
+from freelancer_auth.models import FreelancerModel
+from .routing import get_session
+from .models import MasterProjectModel, ProjectCandidateMapModel, ProjectTeamMemberModel
+
+
+EXPORT_FORMATS = ['csv', 'ndjson']
+EXPORT_COLUMNS = [
+    'project_id', 'project_name', 'client_name', 'project_status', 'segment', 'sub_segment', 'closed_quarter',
+    'closed_year', 'team_members', 'candidate_id', 'freelancer_id', 'freelancer_name', 'candidate_stage',
+    'rejected', 'added_on', 'rate_amount', 'rate_unit', 'rate_currency'
+]
+
+
+def export_query(session, stage=None, segment=None, closed_year=None, candidate_stage=None):
+    members = session.query(
+        ProjectTeamMemberModel.project_id,
+        func.string_agg(UserModel.name, '; ').label('team_members')
+    ).join(UserModel, UserModel.id == ProjectTeamMemberModel.member_id).group_by(
+        ProjectTeamMemberModel.project_id
+    ).subquery()
+
+    query = session.query(
+        MasterProjectModel.id.label('project_id'),
+        MasterProjectModel.name.label('project_name'),
+        ClientMasterModel.name.label('client_name'),
+        MasterProjectModel.project_status,
+        MasterProjectModel.segment,
+        MasterProjectModel.sub_segment,
+        MasterProjectModel.closed_quarter,
+        MasterProjectModel.closed_year,
+        members.c.team_members,
+        ProjectCandidateMapModel.id.label('candidate_id'),
+        ProjectCandidateMapModel.freelancer_id,
+        FreelancerModel.name.label('freelancer_name'),
+        ProjectCandidateMapModel.stage.label('candidate_stage'),
+        ProjectCandidateMapModel.rejected,
+        ProjectCandidateMapModel.added_on,
+        ProjectCandidateMapModel.rate_amount,
+        ProjectCandidateMapModel.rate_unit,
+        ProjectCandidateMapModel.rate_currency,
+    ).outerjoin(
+        ClientMasterModel, ClientMasterModel.id == MasterProjectModel.client_id
+    ).outerjoin(
+        members, members.c.project_id == MasterProjectModel.id
+    ).outerjoin(
+        ProjectCandidateMapModel, ProjectCandidateMapModel.project_id == MasterProjectModel.id
+    ).outerjoin(
+        FreelancerModel, FreelancerModel.id == ProjectCandidateMapModel.freelancer_id
+    )
+    if stage:
+        query = query.filter(MasterProjectModel.project_status == stage)
+    if segment:
+        query = query.filter(MasterProjectModel.segment == segment)
+    if closed_year:
+        query = query.filter(MasterProjectModel.closed_year == str(closed_year))
+    if candidate_stage:
+        query = query.filter(ProjectCandidateMapModel.stage == candidate_stage)
+    return query.order_by(MasterProjectModel.id, ProjectCandidateMapModel.id)
+
+
+def to_value(v):
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        return v.isoformat()
+    return v
+
+
+def iter_export_rows(batch_size=1000, **filters):
+    session = get_session()
+    try:
+        # stream_results makes psycopg2 use a named server side cursor, rows arrive batch_size at a time
+        query = export_query(session, **filters).execution_options(stream_results=True).yield_per(batch_size)
+        for row in query:
+            yield [to_value(getattr(row, c)) for c in EXPORT_COLUMNS]
+    finally:
+        session.close()
+
+
+def stream_csv(batch_size=1000, **filters):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    for values in iter_export_rows(batch_size=batch_size, **filters):
+        writer.writerow(values)
+        rows += 1
+        if rows % batch_size == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def stream_ndjson(batch_size=1000, **filters):
+    lines = []
+    for values in iter_export_rows(batch_size=batch_size, **filters):
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, values))))
+        if len(lines) == batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def stream_export(fmt='csv', **kwargs):
+    if fmt not in EXPORT_FORMATS:
+        raise InvalidRequest("export format {} not supported".format(fmt))
+    return stream_csv(**kwargs) if fmt == 'csv' else stream_ndjson(**kwargs)
+
+
+def write_export(fp, fmt='csv', **kwargs):
+    for chunk in stream_export(fmt, **kwargs):
+        fp.write(chunk)
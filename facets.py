@@ -0,0 +1,65 @@
+from utils.es_conn import es
+
+
+PROJECT_INDEX = 'project'
+
+# facet name -> keyword field on the project doc (see serializers.get_project_json)
+FACET_FIELDS = {
+    'stage': 'project_status.keyword',
+    'segment': 'segment.keyword',
+    'sub_segment': 'sub_segment.keyword',
+    'country': 'country.keyword',
+    'client_type': 'client_type.keyword',
+    'sectors': 'sectors.keyword',
+    'skills': 'skills.keyword',
+    'closed_year': 'closed_year.keyword',
+}
+
+SEARCH_FIELDS = ['project_title^3', 'ac_search_field^2', 'full_text']
+
+
+def filter_clause(facet, values):
+    if not isinstance(values, (list, tuple, set)):
+        values = [values]
+    return {"terms": {FACET_FIELDS[facet]: [str(v) for v in values]}}
+
+
+def build_facet_query(q=None, filters=None, start=0, end=10, facet_size=50):
+    filters = {k: v for k, v in (filters or {}).items() if k in FACET_FIELDS and v not in (None, "", [])}
+    must = [{"multi_match": {"query": q, "fields": SEARCH_FIELDS, "operator": "and"}}] if q else [{"match_all": {}}]
+    clauses = {facet: filter_clause(facet, values) for facet, values in filters.items()}
+
+    # each facet is counted with every filter except its own, so the sidebar keeps showing the alternatives
+    aggs = {}
+    for facet, field in FACET_FIELDS.items():
+        others = [c for f, c in clauses.items() if f != facet]
+        aggs[facet] = {
+            "filter": {"bool": {"filter": others}} if others else {"match_all": {}},
+            "aggs": {"buckets": {"terms": {"field": field, "size": facet_size}}}
+        }
+
+    body = {
+        "query": {"bool": {"must": must}},
+        "post_filter": {"bool": {"filter": list(clauses.values())}},
+        "aggs": aggs,
+        "from": start,
+        "size": max(end - start, 0),
+        "_source": False,
+    }
+    if not q:
+        body["sort"] = [{"created_at": {"order": "desc", "unmapped_type": "date"}}, {"id": {"order": "desc"}}]
+    return body
+
+
+def facet_search(q=None, filters=None, start=0, end=10, facet_size=50):
+    res = es.search(index=PROJECT_INDEX, body=build_facet_query(q, filters, start, end, facet_size))
+    total = res["hits"]["total"]
+    return {
+        "ids": [int(h["_id"]) for h in res["hits"]["hits"]],
+        "scores": [h.get("_score") or 0 for h in res["hits"]["hits"]],
+        "count": total["value"] if isinstance(total, dict) else total,
+        "facets": {
+            facet: [(b["key"], b["doc_count"]) for b in agg["buckets"]["buckets"]]
+            for facet, agg in res["aggregations"].items()
+        }
+    }
@@ -0,0 +1,98 @@
+import time
+import threading
+from sqlalchemy import event, select, literal, union_all
+from sqlalchemy.orm import Session, object_session
+from scales.models import ScaleModel, ScaleCriteraModel
+from .models import ProjectScaleMapModel, ProjectCriteriaMapModel
+
+
+SCALE_CACHE_SECONDS = 300
+SCALE_WRITE_KEY = 'scale_cache_stale'
+
+
+class CachedRow(object):
+    # plain copy of what was loaded, shared between requests and nothing on it can lazy load
+    def __init__(self, obj):
+        self.__dict__.update((k, v) for k, v in vars(obj).items() if not k.startswith('_sa_'))
+
+
+class FeedbackItem(object):
+    # per request view over a cached scale / criteria row, the shared row is never written to
+    __slots__ = ('obj', 'required')
+
+    def __init__(self, obj, required):
+        self.obj = obj
+        self.required = required
+
+    def __getattr__(self, name):
+        return getattr(self.obj, name)
+
+
+class ScaleCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scales = []
+        self.criterias = []
+        self.loaded_at = 0.0
+
+    def get(self, token):
+        from scales.api import Scale, ScaleCritera
+        with self.lock:
+            if time.monotonic() - self.loaded_at > SCALE_CACHE_SECONDS:
+                # through the scales API so the form keeps its filtering and order
+                self.scales = [CachedRow(s.obj) for s in Scale.all(token=token)]
+                self.criterias = [CachedRow(c.obj) for c in ScaleCritera.all_scale_criterias(token=token)]
+                self.loaded_at = time.monotonic()
+            return self.scales, self.criterias
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = 0.0
+
+
+scale_cache = ScaleCache()
+
+
+def mark_scale_write(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[SCALE_WRITE_KEY] = True
+
+
+for model in (ScaleModel, ScaleCriteraModel):
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, mark_scale_write)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_after_scale_write(session):
+    # other workers pick the change up when their copy expires
+    if session.info.pop(SCALE_WRITE_KEY, None):
+        scale_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_scale_write(session):
+    session.info.pop(SCALE_WRITE_KEY, None)
+
+
+def get_required_ids(session, project_id):
+    scales = select([literal('scale').label('kind'), ProjectScaleMapModel.scale_id.label('id')]).where(
+        ProjectScaleMapModel.project_id == project_id
+    )
+    criterias = select([literal('criteria').label('kind'), ProjectCriteriaMapModel.criteria_id.label('id')]).where(
+        ProjectCriteriaMapModel.project_id == project_id
+    )
+    required = {'scale': set(), 'criteria': set()}
+    for kind, id in session.execute(union_all(scales, criterias)):
+        required[kind].add(id)
+    return required['scale'], required['criteria']
+
+
+def get_feedback_form(session, project_id, token):
+    scales, criterias = scale_cache.get(token)
+    required_scales, required_criterias = get_required_ids(session, project_id)
+    return (
+        [FeedbackItem(s, s.id in required_scales) for s in scales],
+        [FeedbackItem(c, c.id in required_criterias) for c in criterias]
+    )
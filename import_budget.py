@@ -0,0 +1,66 @@
+import os
+import sys
+import subprocess
+
+
+# __package__ is set under python -m too, where __name__ is __main__
+PACKAGE = __package__ or __name__.rpartition('.')[0]
+
+# what a worker or a one-off script (reindex, migrations, exports) imports
+LIGHT_MODULES = ['models', 'services', 'rows', 'serializers', 'reindex', 'migrations', 'export']
+
+# the GraphQL and email stack, only query.py / mutations.py may pull these in and only on first use
+HEAVY_MODULES = [
+    'graphene', 'graphql', 'admin.api', 'clients.query', 'clients.services', 'freelancer_profile.api',
+    'freelancer_profile.service', 'process.api', 'scales.api', 'location.query', 'location.services', 'utils.ses',
+    'numpy', 'scipy',
+]
+
+# cumulative microseconds for importing all of LIGHT_MODULES in a fresh interpreter
+IMPORT_BUDGET_US = int(os.environ.get("PROJECT_IMPORT_BUDGET_US", 1500000))
+
+
+def parse_importtime(output):
+    # lines look like "import time:       123 |        456 |   package.module", nesting adds two spaces
+    timings = {}
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        timings[name.strip()] = int(cumulative)
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return timings, total
+
+
+def measure_imports(modules=None):
+    modules = ["{}.{}".format(PACKAGE, m) for m in (modules or LIGHT_MODULES)]
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse_importtime(result.stderr)
+
+
+def check_import_budget(modules=None, budget_us=IMPORT_BUDGET_US):
+    timings, total = measure_imports(modules)
+    problems = []
+    for name in sorted(timings):
+        if any(name == h or name.startswith(h + ".") for h in HEAVY_MODULES):
+            problems.append("{} imported eagerly".format(name))
+    if total > budget_us:
+        problems.append("import took {:.0f}ms, budget is {:.0f}ms".format(total / 1000.0, budget_us / 1000.0))
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check_import_budget()
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
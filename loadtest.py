@@ -0,0 +1,397 @@
+import time
+import random
+import datetime
+import threading
+from sqlalchemy import func
+from auth.models import UserModel
+from clients.models import ClientMasterModel
+from freelancer_auth.models import FreelancerModel
+from .archive import CLOSED_STAGES
+from .models import (
+    MasterProjectModel, ProjectCandidateMapModel, ProjectNoteModel, MasterProjectAttributeMap, ProjectTeamMemberModel,
+    ProjectDirectorsModel, ProjectStakeholdersModel, ProjectScopeFileModel, ProjectScopeLinkModel, LoadTestProjectModel
+)
+
+
+# only used to make generated rows recognisable in the UI, generated ids are tracked in loadtest_projects
+SYNTHETIC_PREFIX = "loadtest-"
+
+# roughly production cardinalities, pass a smaller dict for a laptop run
+DEFAULT_SCALE = {
+    'projects': 20000,
+    'candidates_per_project': 40,
+    'notes_per_project': 6,
+}
+
+PROJECT_STAGES = [("Market Scan", 3), ("Selection", 2), ("Matching", 4), ("Contracting", 1), ("Won", 25), ("Lost", 15)]
+SEGMENTS = ["Strategy", "Operations", "Technology", "Finance", "People"]
+WORDS = [
+    "market", "entry", "supply", "chain", "pricing", "digital", "transformation", "due", "diligence", "growth",
+    "strategy", "operations", "cost", "reduction", "procurement", "analytics", "customer", "retention", "india",
+    "expansion", "healthcare", "fintech", "retail", "energy", "logistics", "regulatory", "assessment", "roadmap",
+]
+RATE_UNITS = ["hour", "day", "month"]
+CURRENCIES = [("INR", 6), ("USD", 3), ("EUR", 1)]
+
+# operation name -> weight, the mix the admin UI produces
+DEFAULT_MIX = {
+    'list': 30,
+    'search': 20,
+    'detail': 25,
+    'edit_candidate': 12,
+    'add_note': 8,
+    'save_project': 5,
+}
+
+
+def weighted(rng, choices):
+    total = sum(w for _, w in choices)
+    pick = rng.uniform(0, total)
+    for value, w in choices:
+        pick -= w
+        if pick <= 0:
+            return value
+    return choices[-1][0]
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+class DataGenerator(object):
+    # freelancers, clients and users belong to other apps, generated rows point at existing ones
+    def __init__(self, session, seed=1, scale=None):
+        self.session = session
+        self.rng = random.Random(seed)
+        self.scale = dict(DEFAULT_SCALE, **(scale or {}))
+
+    def existing_ids(self, column, limit=50000):
+        return [i for i, in self.session.query(column).order_by(column).limit(limit)]
+
+    def project_row(self, n, client_ids):
+        rng = self.rng
+        stage = weighted(rng, PROJECT_STAGES)
+        created_at = datetime.datetime.utcnow() - datetime.timedelta(days=rng.randint(0, 5 * 365))
+        min_years = rng.randint(0, 10)
+        return {
+            'name': "{}{} {}".format(SYNTHETIC_PREFIX, n, sentence(rng, 3)),
+            'project_type': rng.choice(['freelance', 'firm', 'rfp']),
+            'background': sentence(rng, 60),
+            'notes': sentence(rng, 20),
+            'client_id': rng.choice(client_ids) if client_ids else None,
+            'duration_unit': rng.choice(['weeks', 'months']),
+            'duration_count': rng.randint(1, 12),
+            'budget_currency': weighted(rng, CURRENCIES),
+            'budget_amount': rng.randint(1, 500) * 1000,
+            'budget_unit': rng.choice(['day', 'month', 'project']),
+            'min_years_experience': min_years,
+            'max_years_experience': min_years + rng.randint(2, 10),
+            'project_status': stage,
+            'archived': stage in CLOSED_STAGES,
+            'segment': rng.choice(SEGMENTS),
+            'created_at': created_at,
+            'closed_year': str(created_at.year) if stage in CLOSED_STAGES else None,
+        }
+
+    def generate(self, batch_size=1000):
+        session = self.session
+        rng = self.rng
+        client_ids = self.existing_ids(ClientMasterModel.id)
+        freelancer_ids = self.existing_ids(FreelancerModel.id)
+        admin_ids = self.existing_ids(UserModel.id)
+        stages = [s for s, in session.query(ProjectCandidateMapModel.stage).distinct() if s] or ["Longlist"]
+
+        start = session.query(func.count(LoadTestProjectModel.project_id)).scalar()
+        total = self.scale['projects']
+        for offset in range(0, total, batch_size):
+            rows = [self.project_row(start + offset + i, client_ids) for i in range(min(batch_size, total - offset))]
+            session.bulk_insert_mappings(MasterProjectModel, rows, return_defaults=True)
+            session.bulk_insert_mappings(LoadTestProjectModel, [{'project_id': row['id']} for row in rows])
+            candidates, notes, attrs = [], [], []
+            for row in rows:
+                picked = rng.sample(freelancer_ids, min(len(freelancer_ids), rng.randint(
+                    0, 2 * self.scale['candidates_per_project']
+                )))
+                for freelancer_id in picked:
+                    candidates.append({
+                        'project_id': row['id'],
+                        'freelancer_id': freelancer_id,
+                        'stage': rng.choice(stages),
+                        'rejected': rng.random() < 0.1,
+                        'added_on': row['created_at'] + datetime.timedelta(days=rng.randint(0, 60)),
+                        'rate_unit': rng.choice(RATE_UNITS),
+                        'rate_currency': weighted(rng, CURRENCIES),
+                        'rate_amount': rng.randint(10, 400) * 100,
+                    })
+                for _ in range(rng.randint(0, 2 * self.scale['notes_per_project'])):
+                    notes.append({
+                        'project_id': row['id'],
+                        'admin_id': rng.choice(admin_ids) if admin_ids else None,
+                        'note': sentence(rng, 25),
+                        'created_at': row['created_at'] + datetime.timedelta(hours=rng.randint(0, 2000)),
+                    })
+                for map_name in ('expertise', 'sector'):
+                    for map_id in rng.sample(range(1, 200), rng.randint(1, 5)):
+                        attrs.append({'project_id': row['id'], 'map_name': map_name, 'map_id': map_id})
+            session.bulk_insert_mappings(ProjectCandidateMapModel, candidates)
+            session.bulk_insert_mappings(ProjectNoteModel, notes)
+            session.bulk_insert_mappings(MasterProjectAttributeMap, attrs)
+            session.commit()
+            print("generated {} / {} projects".format(offset + len(rows), total))
+        # bulk inserts skip the mapper events that keep the normalised costs current
+        from .migrations import backfill_costs
+        backfill_costs(session)
+
+
+def synthetic_project_ids(session):
+    return [i for i, in session.query(LoadTestProjectModel.project_id).join(
+        MasterProjectModel, MasterProjectModel.id == LoadTestProjectModel.project_id
+    )]
+
+
+def drop_synthetic_data(session, batch_size=1000):
+    ids = [i for i, in session.query(LoadTestProjectModel.project_id)]
+    for n in range(0, len(ids), batch_size):
+        batch = ids[n:n + batch_size]
+        for model in (
+            ProjectCandidateMapModel, ProjectNoteModel, MasterProjectAttributeMap, ProjectTeamMemberModel,
+            ProjectDirectorsModel, ProjectStakeholdersModel, ProjectScopeFileModel, ProjectScopeLinkModel
+        ):
+            session.query(model).filter(model.project_id.in_(batch)).delete(synchronize_session=False)
+        session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(batch)).delete(synchronize_session=False)
+        session.query(LoadTestProjectModel).filter(
+            LoadTestProjectModel.project_id.in_(batch)
+        ).delete(synchronize_session=False)
+        session.commit()
+
+
+def unwrap_type(graphql_type):
+    while hasattr(graphql_type, 'of_type'):
+        graphql_type = graphql_type.of_type
+    return graphql_type
+
+
+def find_field(root, type_name, args=()):
+    # root field names live in the app's schema module, look them up by the type they return
+    for name, field in root.fields.items():
+        if unwrap_type(field.type).name == type_name and all(a in field.args for a in args):
+            return name
+    raise LookupError("no root field returning {} with arguments {}".format(type_name, args))
+
+
+class Operation(object):
+    def __init__(self, name, document, variables):
+        self.name = name
+        self.document = document
+        self.variables = variables
+
+
+def operation_document(kind, root, field, args, selection):
+    # only pass the arguments this schema's root field declares, typed the way it declares them
+    available = root.fields[field].args
+    used = [a for a in args if a in available]
+    if not used:
+        return "%s { %s %s }" % (kind, field, selection)
+    declare = ", ".join("${}: {}".format(a, available[a].type) for a in used)
+    call = ", ".join("{0}: ${0}".format(a) for a in used)
+    return "%s (%s) { %s(%s) %s }" % (kind, declare, field, call, selection)
+
+
+def build_operations(schema):
+    query = schema.get_query_type()
+    mutation = schema.get_mutation_type()
+
+    def list_vars(ctx, rng):
+        start = rng.randint(0, 5) * 10
+        return {'token': ctx.token, 'filterStage': weighted(rng, PROJECT_STAGES), 'start': start, 'end': start + 9}
+
+    def search_vars(ctx, rng):
+        return {'token': ctx.token, 'q': " ".join(rng.sample(WORDS, rng.randint(1, 3))), 'start': 0, 'end': 9}
+
+    def detail_vars(ctx, rng):
+        return {'token': ctx.token, 'id': ctx.project(rng)}
+
+    def edit_candidate_vars(ctx, rng):
+        project_id, candidate_id = ctx.candidate(rng)
+        return {'token': ctx.token, 'projectId': project_id, 'candidateId': [candidate_id], 'status': ctx.stage(rng)}
+
+    def add_note_vars(ctx, rng):
+        return {'token': ctx.token, 'projectId': ctx.project(rng), 'note': SYNTHETIC_PREFIX + sentence(rng, 12)}
+
+    def save_project_vars(ctx, rng):
+        project_id = ctx.project(rng)
+        return {
+            'token': ctx.token, 'id': project_id, 'name': "{}{} {}".format(SYNTHETIC_PREFIX, project_id, sentence(rng, 3)),
+            'background': sentence(rng, 60), 'segment': rng.choice(SEGMENTS),
+            'projectStatus': ctx.project_status(project_id),
+        }
+
+    # (name, root, returned type, required args, args sent, selection, variables)
+    specs = [
+        ('list', query, 'MasterProjectWithCount', ['filterStage'], ['token', 'filterStage', 'start', 'end'],
+         "{ count projects { id name projectStage createdAt totalCandidates } }", list_vars),
+        ('search', query, 'MasterProjectWithCount', ['q'], ['token', 'q', 'start', 'end'],
+         "{ count projects { id name projectStage } }", search_vars),
+        ('detail', query, 'MasterProject', ['id'], ['token', 'id'],
+         "{ id name background projectStage budgetAmount budgetCurrency budgetUnit "
+         "candidateCounts { stageName count } "
+         "candidates(start: 0, end: 19) { id status rateAmount rateCurrency rateUnit isActive } "
+         "noteFeed(first: 10) { notes { id note createdBy } hasMore nextCursor } }", detail_vars),
+        ('edit_candidate', mutation, 'EditMasterProjectCandidate', [], ['token', 'projectId', 'candidateId', 'status'],
+         "{ masterProject { id totalCandidates } }", edit_candidate_vars),
+        ('add_note', mutation, 'AddProjectNote', [], ['token', 'projectId', 'note'], "{ message }", add_note_vars),
+        ('save_project', mutation, 'AddMasterProject', [],
+         ['token', 'id', 'name', 'background', 'segment', 'projectStatus'], "{ project { id modifiedAt } }",
+         save_project_vars),
+    ]
+    operations = {}
+    for name, root, type_name, required, args, selection, variables in specs:
+        field = find_field(root, type_name, required)
+        kind = "mutation" if root is mutation else "query"
+        operations[name] = Operation(name, operation_document(kind, root, field, args, selection), variables)
+    return operations
+
+
+class LoadContext(object):
+    # ids the operations draw from, loaded once before the run
+    def __init__(self, session, token, sample_size=2000, seed=1):
+        rng = random.Random(seed)
+        # never fall back to real projects, the write operations rename them and clear their team
+        ids = synthetic_project_ids(session)
+        if not ids:
+            raise LookupError("no generated projects to load test against, run DataGenerator first")
+        self.token = token
+        self.project_ids = rng.sample(ids, min(sample_size, len(ids)))
+        self.statuses = dict(session.query(MasterProjectModel.id, MasterProjectModel.project_status).filter(
+            MasterProjectModel.id.in_(self.project_ids)
+        ))
+        self.candidates = session.query(ProjectCandidateMapModel.project_id, ProjectCandidateMapModel.id).filter(
+            ProjectCandidateMapModel.project_id.in_(self.project_ids)
+        ).all()
+        self.stages = [s for s, in session.query(ProjectCandidateMapModel.stage).distinct() if s] or ["Longlist"]
+
+    def project(self, rng):
+        return rng.choice(self.project_ids)
+
+    def project_status(self, project_id):
+        return self.statuses.get(project_id)
+
+    def candidate(self, rng):
+        return tuple(rng.choice(self.candidates))
+
+    def stage(self, rng):
+        return rng.choice(self.stages)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    rank = max(int(round(p / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class OperationStats(object):
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.last_error = None
+
+    def observe(self, elapsed, error=None):
+        self.latencies.append(elapsed)
+        if error is not None:
+            self.errors += 1
+            self.last_error = error
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'count': count,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'error_rate': self.errors / float(count) if count else 0.0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'last_error': self.last_error,
+        }
+
+
+class LoadTest(object):
+    def __init__(self, schema, context, mix=None, concurrency=8, think_time=0.0, execute=None, seed=1):
+        self.operations = build_operations(schema)
+        self.mix = [(name, w) for name, w in (mix or DEFAULT_MIX).items() if w]
+        self.context = context
+        self.concurrency = concurrency
+        self.think_time = think_time
+        self.seed = seed
+        # pluggable so the same run can go through async_execution.execute or the persisted query registry
+        self.execute = execute or (lambda document, variables: schema.execute(document, variable_values=variables))
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.recording = False
+
+    def record(self, name, elapsed, error):
+        if not self.recording:
+            return
+        with self.lock:
+            self.stats.setdefault(name, OperationStats()).observe(elapsed, error)
+
+    def worker(self, n, stop_at):
+        rng = random.Random(self.seed * 1000 + n)
+        while time.monotonic() < stop_at:
+            op = self.operations[weighted(rng, self.mix)]
+            variables = op.variables(self.context, rng)
+            started = time.perf_counter()
+            try:
+                result = self.execute(op.document, variables)
+                error = str(result.errors[0]) if result.errors else None
+            except Exception as e:
+                error = repr(e)
+            self.record(op.name, time.perf_counter() - started, error)
+            if self.think_time:
+                # exponential think time, the gaps between real users' clicks are not uniform
+                time.sleep(rng.expovariate(1.0 / self.think_time))
+
+    def run(self, duration=60, warmup=5):
+        started = time.monotonic()
+        stop_at = started + warmup + duration
+        threads = [
+            threading.Thread(target=self.worker, args=(n, stop_at), daemon=True) for n in range(self.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(warmup)
+        self.recording = True
+        measured_from = time.monotonic()
+        for t in threads:
+            t.join()
+        self.recording = False
+        return self.report(time.monotonic() - measured_from)
+
+    def report(self, elapsed):
+        ans = {name: stats.summary(elapsed) for name, stats in sorted(self.stats.items())}
+        total = OperationStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+        ans['total'] = total.summary(elapsed)
+        return ans
+
+
+def format_report(report):
+    def ms(v):
+        return "-" if v is None else "{:.1f}".format(v * 1000)
+    lines = ["{:<16}{:>8}{:>10}{:>9}{:>9}{:>9}{:>9}".format("operation", "count", "req/s", "err%", "p50", "p95", "p99")]
+    for name, s in report.items():
+        lines.append("{:<16}{:>8}{:>10.1f}{:>9.2f}{:>9}{:>9}{:>9}".format(
+            name, s['count'], s['throughput'], s['error_rate'] * 100, ms(s['p50']), ms(s['p95']), ms(s['p99'])
+        ))
+    return "\n".join(lines)
+
+
+def run_load_test(schema, session, token, duration=60, concurrency=8, think_time=0.0, mix=None, seed=1, **kwargs):
+    context = LoadContext(session, token, seed=seed)
+    session.close()
+    report = LoadTest(schema, context, mix, concurrency, think_time, seed=seed, **kwargs).run(duration)
+    print(format_report(report))
+    return report
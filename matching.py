@@ -0,0 +1,405 @@
+import time
+import datetime
+import threading
+import numpy as np
+from scipy import sparse
+from sqlalchemy import func, or_
+from .models import MasterProjectModel, MasterProjectAttributeMap, ProjectCandidateMapModel, ProjectTombstoneModel
+
+
+SKILL_WEIGHT = 0.5
+SECTOR_WEIGHT = 0.3
+EXPERIENCE_WEIGHT = 0.1
+LOCATION_WEIGHT = 0.1
+# years outside the project's range after which the experience score reaches 0
+EXPERIENCE_SLACK = 5.0
+# pending row overrides folded back into the base matrix once there are this many
+COMPACT_AFTER = 2000
+# how often a worker checks the database for writes other workers made, and rebuilds from scratch
+REFRESH_SECONDS = 30
+REBUILD_SECONDS = 6 * 3600
+# modified_at is a transaction start time, re-read a little history so late commits are not missed
+REFRESH_OVERLAP = datetime.timedelta(minutes=5)
+
+
+class Vocabulary(object):
+    def __init__(self):
+        self.index = {}
+
+    def get(self, key, add=False):
+        i = self.index.get(key)
+        if i is None and add:
+            i = self.index[key] = len(self.index)
+        return i
+
+    def __len__(self):
+        return len(self.index)
+
+
+class IncidenceMatrix(object):
+    # rows are entities, columns are attribute ids. writes land in `overrides` and leave the base csr
+    # untouched so an update costs O(row) and scoring still runs one sparse mat-vec over the base
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.base = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.overrides = {}
+
+    def set_row(self, row, keys):
+        self.overrides[row] = sorted({self.vocab.get(k, add=True) for k in keys})
+        if len(self.overrides) >= COMPACT_AFTER:
+            self.compact()
+
+    def row_cols(self, row):
+        if row in self.overrides:
+            return self.overrides[row]
+        if row < self.base.shape[0]:
+            return self.base.indices[self.base.indptr[row]:self.base.indptr[row + 1]].tolist()
+        return []
+
+    def vector(self, row):
+        v = np.zeros(len(self.vocab), dtype=np.float32)
+        v[self.row_cols(row)] = 1.0
+        return v
+
+    def compact(self, n_rows=None):
+        n_rows = max(n_rows or 0, self.base.shape[0], max(self.overrides) + 1 if self.overrides else 0)
+        coo = self.base.tocoo()
+        override_rows = np.fromiter(self.overrides.keys(), dtype=np.int64, count=len(self.overrides))
+        keep = ~np.isin(coo.row, override_rows)
+        rows = [coo.row[keep]] + [np.full(len(cols), row, dtype=np.int64) for row, cols in self.overrides.items()]
+        cols = [coo.col[keep]] + [np.asarray(cols, dtype=np.int64) for cols in self.overrides.values()]
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        self.base = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_rows, len(self.vocab))
+        )
+        self.overrides = {}
+
+    def dot(self, v, n_rows):
+        out = np.zeros(n_rows, dtype=np.float32)
+        b_rows, b_cols = self.base.shape
+        if b_rows:
+            out[:b_rows] = self.base.dot(v[:b_cols])
+        if self.overrides:
+            rows = np.fromiter(self.overrides.keys(), dtype=np.int64, count=len(self.overrides))
+            out[rows] = [v[cols].sum() if cols else 0.0 for cols in self.overrides.values()]
+        return out
+
+
+class FeatureColumn(object):
+    def __init__(self, fill=np.nan, dtype=np.float32):
+        self.fill = fill
+        self.values = np.full(1024, fill, dtype=dtype)
+
+    def set(self, row, value):
+        if row >= len(self.values):
+            grown = np.full(max(row + 1, len(self.values) * 2), self.fill, dtype=self.values.dtype)
+            grown[:len(self.values)] = self.values
+            self.values = grown
+        self.values[row] = self.fill if value is None else value
+
+    def get(self, row):
+        return self.values[row]
+
+    def view(self, n_rows):
+        if n_rows > len(self.values):
+            self.set(n_rows - 1, None)
+        return self.values[:n_rows]
+
+
+class EntityTable(object):
+    def __init__(self, skill_vocab, sector_vocab, columns):
+        self.ids = []
+        self.index = {}
+        self.active = FeatureColumn(fill=0, dtype=np.int8)
+        self.skills = IncidenceMatrix(skill_vocab)
+        self.sectors = IncidenceMatrix(sector_vocab)
+        self.columns = {name: FeatureColumn() for name in columns}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, entity_id, add=False):
+        i = self.index.get(entity_id)
+        if i is None and add:
+            i = self.index[entity_id] = len(self.ids)
+            self.ids.append(entity_id)
+        return i
+
+    def upsert(self, entity_id, skills, sectors, **values):
+        i = self.row(entity_id, add=True)
+        self.skills.set_row(i, skills or [])
+        self.sectors.set_row(i, sectors or [])
+        for name, column in self.columns.items():
+            column.set(i, values.get(name))
+        self.active.set(i, 1)
+        return i
+
+    def remove(self, entity_id):
+        i = self.row(entity_id)
+        if i is not None:
+            self.skills.set_row(i, [])
+            self.sectors.set_row(i, [])
+            self.active.set(i, 0)
+
+    def compact(self):
+        self.skills.compact(len(self))
+        self.sectors.compact(len(self))
+
+
+def top_k(scores, ids, k, mask=None):
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(ids[i], float(scores[i])) for i in top]
+
+
+def experience_fit(years, min_years, max_years):
+    lower = np.where(np.isnan(min_years), -np.inf, min_years)
+    upper = np.where(np.isnan(max_years), np.inf, max_years)
+    distance = np.maximum(lower - years, 0) + np.maximum(years - upper, 0)
+    fit = np.clip(1.0 - distance / EXPERIENCE_SLACK, 0.0, 1.0)
+    # unknown experience is neutral rather than a miss
+    return np.where(np.isnan(years), 0.5, fit)
+
+
+def location_fit(a, b):
+    return np.where(np.isnan(a) | np.isnan(b), 0.5, (a == b).astype(np.float32))
+
+
+class MatchingEngine(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.skill_vocab = Vocabulary()
+        self.sector_vocab = Vocabulary()
+        self.country_vocab = Vocabulary()
+        self.projects = EntityTable(self.skill_vocab, self.sector_vocab, ['min_years', 'max_years', 'country'])
+        self.freelancers = EntityTable(self.skill_vocab, self.sector_vocab, ['years', 'country'])
+        self.modified_since = None
+        self.built_at = self.checked_at = 0.0
+
+    def country_code(self, country):
+        if not country:
+            return None
+        return self.country_vocab.get(country.strip().lower(), add=True)
+
+    def update_project(self, project_id, skills, sectors, min_years=None, max_years=None, country=None):
+        with self.lock:
+            self.projects.upsert(
+                project_id, skills, sectors,
+                min_years=min_years, max_years=max_years, country=self.country_code(country)
+            )
+
+    def update_freelancer(self, freelancer_id, skills, sectors, years=None, country=None):
+        with self.lock:
+            self.freelancers.upsert(freelancer_id, skills, sectors, years=years, country=self.country_code(country))
+
+    def remove_project(self, project_id):
+        with self.lock:
+            self.projects.remove(project_id)
+
+    def remove_freelancer(self, freelancer_id):
+        with self.lock:
+            self.freelancers.remove(freelancer_id)
+
+    def compact(self):
+        with self.lock:
+            self.projects.compact()
+            self.freelancers.compact()
+
+    def overlap(self, source, row, target):
+        n = len(target)
+        skills = source.skills.vector(row)
+        sectors = source.sectors.vector(row)
+        skill_score = target.skills.dot(skills, n) / max(skills.sum(), 1.0)
+        sector_score = target.sectors.dot(sectors, n) / max(sectors.sum(), 1.0)
+        return SKILL_WEIGHT * skill_score + SECTOR_WEIGHT * sector_score
+
+    def candidates_for_project(self, project_id, k=50, exclude=()):
+        with self.lock:
+            row = self.projects.row(project_id)
+            n = len(self.freelancers)
+            if row is None or not n:
+                return []
+            scores = self.overlap(self.projects, row, self.freelancers)
+            cols = self.projects.columns
+            fcols = self.freelancers.columns
+            scores += EXPERIENCE_WEIGHT * experience_fit(
+                fcols['years'].view(n), cols['min_years'].get(row), cols['max_years'].get(row)
+            )
+            scores += LOCATION_WEIGHT * location_fit(fcols['country'].view(n), cols['country'].get(row))
+            mask = self.freelancers.active.view(n).astype(bool)
+            for freelancer_id in exclude:
+                i = self.freelancers.row(freelancer_id)
+                if i is not None:
+                    mask[i] = False
+            return top_k(scores, self.freelancers.ids, k, mask)
+
+    def projects_for_freelancer(self, freelancer_id, k=20, exclude=()):
+        with self.lock:
+            row = self.freelancers.row(freelancer_id)
+            n = len(self.projects)
+            if row is None or not n:
+                return []
+            scores = self.overlap(self.freelancers, row, self.projects)
+            cols = self.projects.columns
+            fcols = self.freelancers.columns
+            scores += EXPERIENCE_WEIGHT * experience_fit(
+                fcols['years'].get(row), cols['min_years'].view(n), cols['max_years'].view(n)
+            )
+            scores += LOCATION_WEIGHT * location_fit(cols['country'].view(n), fcols['country'].get(row))
+            mask = self.projects.active.view(n).astype(bool)
+            for project_id in exclude:
+                i = self.projects.row(project_id)
+                if i is not None:
+                    mask[i] = False
+            return top_k(scores, self.projects.ids, k, mask)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def candidate_history_source(session, freelancer_ids=None):
+    # default source built from this package's own tables: a freelancer's skills and sectors are those
+    # of the projects they have been put forward for. register a profile backed source with
+    # set_freelancer_source to match on the freelancer's own profile instead
+    candidates = session.query(ProjectCandidateMapModel.freelancer_id, ProjectCandidateMapModel.project_id).filter(
+        or_(ProjectCandidateMapModel.stage.is_(None), ProjectCandidateMapModel.stage != "Remove from project")
+    )
+    if freelancer_ids is not None:
+        candidates = candidates.filter(ProjectCandidateMapModel.freelancer_id.in_(freelancer_ids))
+    projects = {}
+    for freelancer_id, project_id in candidates:
+        projects.setdefault(freelancer_id, set()).add(project_id)
+    attrs = project_attribute_ids(session, {p for ps in projects.values() for p in ps})
+    for freelancer_id, project_ids in projects.items():
+        skills, sectors = set(), set()
+        for project_id in project_ids:
+            a = attrs.get(project_id, {})
+            skills.update(a.get("expertise", []))
+            sectors.update(a.get("sector", []))
+        yield freelancer_id, sorted(skills), sorted(sectors), None, None
+
+
+# callable source(session, freelancer_ids=None) yielding (freelancer_id, skill_ids, sector_ids, years, country),
+# freelancer_ids=None means every freelancer
+_freelancer_source = candidate_history_source
+
+
+def set_freelancer_source(source):
+    global _freelancer_source, _engine
+    _freelancer_source = source
+    # the next get_engine() rebuilds from the new source
+    _engine = None
+
+
+def project_attribute_ids(session, project_ids=None):
+    query = session.query(
+        MasterProjectAttributeMap.project_id, MasterProjectAttributeMap.map_name, MasterProjectAttributeMap.map_id
+    )
+    if project_ids is not None:
+        query = query.filter(MasterProjectAttributeMap.project_id.in_(project_ids))
+    attrs = {}
+    for project_id, map_name, map_id in query:
+        attrs.setdefault(project_id, {"expertise": [], "sector": []}).setdefault(map_name, []).append(map_id)
+    return attrs
+
+
+def load_projects(engine, session, project_ids=None):
+    attrs = project_attribute_ids(session, project_ids)
+    query = session.query(
+        MasterProjectModel.id, MasterProjectModel.min_years_experience, MasterProjectModel.max_years_experience,
+        MasterProjectModel.country
+    )
+    if project_ids is not None:
+        query = query.filter(MasterProjectModel.id.in_(project_ids))
+    for project_id, min_years, max_years, country in query:
+        a = attrs.get(project_id, {})
+        engine.update_project(project_id, a.get("expertise"), a.get("sector"), min_years, max_years, country)
+
+
+def load_freelancers(engine, session, freelancer_ids=None):
+    if _freelancer_source is None:
+        return
+    for freelancer_id, skills, sectors, years, country in _freelancer_source(session, freelancer_ids):
+        engine.update_freelancer(freelancer_id, skills, sectors, years, country)
+
+
+def modified_watermark(session):
+    # modified_at is bumped for candidate and attribute writes too, see migrations.TRIGGERS
+    return session.query(func.max(MasterProjectModel.modified_at)).scalar()
+
+
+def build_engine(session):
+    engine = MatchingEngine()
+    engine.modified_since = modified_watermark(session)
+    load_projects(engine, session)
+    load_freelancers(engine, session)
+    engine.compact()
+    engine.built_at = engine.checked_at = time.monotonic()
+    return engine
+
+
+def refresh_engine(engine, session):
+    # every worker process holds its own engine, writes handled by other workers reach it through here
+    since = engine.modified_since
+    engine.modified_since = modified_watermark(session)
+    engine.checked_at = time.monotonic()
+    if since is None:
+        return
+    since = since - REFRESH_OVERLAP
+    changed = [pid for pid, in session.query(MasterProjectModel.id).filter(MasterProjectModel.modified_at > since)]
+    if changed:
+        load_projects(engine, session, changed)
+        freelancer_ids = [fid for fid, in session.query(ProjectCandidateMapModel.freelancer_id).filter(
+            ProjectCandidateMapModel.project_id.in_(changed)
+        ).distinct()]
+        if freelancer_ids:
+            load_freelancers(engine, session, freelancer_ids)
+    for project_id, in session.query(ProjectTombstoneModel.project_id).filter(ProjectTombstoneModel.deleted_at > since):
+        engine.remove_project(project_id)
+
+
+def get_engine():
+    global _engine
+    engine = _engine
+    now = time.monotonic()
+    if engine is not None and now - engine.checked_at < REFRESH_SECONDS:
+        return engine
+    with _engine_lock:
+        if _engine is None or now - _engine.built_at > REBUILD_SECONDS:
+            from .routing import get_session
+            session = get_session()
+            _engine = build_engine(session)
+            session.close()
+        elif now - _engine.checked_at >= REFRESH_SECONDS:
+            from .routing import get_session
+            session = get_session()
+            refresh_engine(_engine, session)
+            session.close()
+    return _engine
+
+
+def project_written(session, project_id):
+    # keeps this worker's engine current right away, the others pick the write up in refresh_engine
+    if _engine is not None:
+        load_projects(_engine, session, [project_id])
+
+
+def project_deleted(project_id):
+    if _engine is not None:
+        _engine.remove_project(project_id)
+
+
+def freelancer_written(freelancer_id, skills, sectors, years=None, country=None):
+    if _engine is not None:
+        _engine.update_freelancer(freelancer_id, skills, sectors, years, country)
+
+
+def freelancer_deleted(freelancer_id):
+    if _engine is not None:
+        _engine.remove_freelancer(freelancer_id)
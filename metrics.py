@@ -0,0 +1,149 @@
+import json
+import time
+import threading
+from promise import is_thenable
+
+
+TIMED_TYPES = ['MasterProject', 'ProjectSmall', 'ProjectCandidate', 'ProjectNote']
+
+# upper bounds in seconds, prometheus style cumulative buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class FieldHistogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, elapsed, failed=False):
+        self.count += 1
+        self.total += elapsed
+        if failed:
+            self.errors += 1
+        for i, bound in enumerate(self.buckets):
+            if elapsed <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        running = 0
+        ans = []
+        for bound, c in zip(self.buckets, self.counts):
+            running += c
+            ans.append((bound, running))
+        return ans
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "sum": self.total,
+            "avg": self.total / self.count if self.count else 0.0,
+            "buckets": [{"le": bound, "count": c} for bound, c in self.cumulative()]
+        }
+
+
+class ResolverMetrics(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, type_name, field_name, elapsed, failed=False):
+        key = (type_name, field_name)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = FieldHistogram(self.buckets)
+            hist.observe(elapsed, failed)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "{}.{}".format(type_name, field_name): hist.to_dict()
+                for (type_name, field_name), hist in sorted(self.histograms.items())
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, name="project_resolver_latency_seconds"):
+        lines = [
+            "# HELP {} Resolver latency per graphql field".format(name),
+            "# TYPE {} histogram".format(name)
+        ]
+        errors = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for (type_name, field_name), hist in items:
+                labels = 'type="{}",field="{}"'.format(type_name, field_name)
+                for bound, c in hist.cumulative():
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, c))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, hist.count))
+                lines.append('{}_sum{{{}}} {}'.format(name, labels, hist.total))
+                lines.append('{}_count{{{}}} {}'.format(name, labels, hist.count))
+                errors.append('{}_errors_total{{{}}} {}'.format(name, labels, hist.errors))
+        if errors:
+            lines.append("# TYPE {}_errors_total counter".format(name))
+            lines.extend(errors)
+        return "\n".join(lines) + "\n"
+
+
+resolver_metrics = ResolverMetrics()
+
+
+def mutation_type_name(info):
+    mutation_type = info.schema.get_mutation_type()
+    return mutation_type.name if mutation_type else None
+
+
+class ResolverTimingMiddleware(object):
+    def __init__(self, metrics=None, types=TIMED_TYPES, time_mutations=True):
+        self.metrics = metrics if metrics is not None else resolver_metrics
+        self.types = set(types)
+        self.time_mutations = time_mutations
+
+    def should_time(self, info):
+        type_name = info.parent_type.name
+        if type_name in self.types:
+            return True
+        return self.time_mutations and type_name == mutation_type_name(info)
+
+    def resolve(self, next, root, info, **args):
+        if not self.should_time(info):
+            return next(root, info, **args)
+        type_name, field_name = info.parent_type.name, info.field_name
+        started = time.perf_counter()
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            self.metrics.observe(type_name, field_name, time.perf_counter() - started, failed=True)
+            raise
+
+        if is_thenable(result):
+            def on_resolved(value):
+                self.metrics.observe(type_name, field_name, time.perf_counter() - started)
+                return value
+
+            def on_rejected(error):
+                self.metrics.observe(type_name, field_name, time.perf_counter() - started, failed=True)
+                raise error
+            return result.then(on_resolved, on_rejected)
+
+        self.metrics.observe(type_name, field_name, time.perf_counter() - started)
+        return result
+
+
+def export_prometheus():
+    return resolver_metrics.to_prometheus()
+
+
+def export_json():
+    return resolver_metrics.to_json()
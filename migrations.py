@@ -0,0 +1,283 @@
+import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+# duplicates have to go before the unique indexes can be built. these are plain link rows, a duplicate
+# carries nothing its twin does not, so the lowest id wins
+DEDUPE = [
+    ("master_project_attribute_map", ["project_id", "map_name", "map_id"]),
+    ("project_team_members", ["project_id", "member_id"]),
+    ("project_directors", ["project_id", "director_id"]),
+]
+
+# rows with data of their own (stage, quote), duplicates are reported and the upgrade stops until
+# someone has decided which row to keep
+DUPLICATE_CHECKS = [
+    ("project_candidate_map", ["project_id", "freelancer_id"]),
+]
+
+INDEXES = [
+    ("uq_project_candidate_map_project_freelancer", "project_candidate_map", ["project_id", "freelancer_id"], True),
+    ("ix_project_candidate_map_freelancer_id", "project_candidate_map", ["freelancer_id"], False),
+    ("uq_master_project_attribute_map_project_map", "master_project_attribute_map", ["project_id", "map_name", "map_id"], True),
+    ("ix_master_project_attribute_map_project_map_name", "master_project_attribute_map", ["project_id", "map_name"], False),
+    ("uq_project_team_members_project_member", "project_team_members", ["project_id", "member_id"], True),
+    ("ix_project_team_members_member_id", "project_team_members", ["member_id"], False),
+    ("uq_project_directors_project_director", "project_directors", ["project_id", "director_id"], True),
+    ("ix_project_directors_director_id", "project_directors", ["director_id"], False),
+    ("ix_master_projects_status_created_desc", "master_projects",
+     ["project_status", "created_at DESC NULLS LAST", "id DESC"], False),
+    ("ix_master_projects_budget_daily_base", "master_projects", ["budget_daily_base"], False),
+    ("ix_project_candidate_map_project_daily_rate", "project_candidate_map", ["project_id", "daily_rate_base"], False),
+    ("ix_project_notes_project_created_desc", "project_notes", ["project_id", "created_at DESC NULLS LAST", "id DESC"],
+     False),
+    ("ix_master_projects_live_status_created_desc", "master_projects",
+     ["project_status", "created_at DESC NULLS LAST", "id DESC"], False, "NOT archived"),
+    ("ix_master_projects_archived_closed_year", "master_projects", ["closed_year", "created_at"], False, "archived"),
+    ("ix_master_projects_modified_at", "master_projects", ["modified_at"], False),
+    ("ix_project_tombstones_deleted_at", "project_tombstones", ["deleted_at"], False),
+]
+
+# superseded by an entry above, dropped once its replacement is built
+DROPPED_INDEXES = [
+    "ix_project_notes_project_created_at",
+    "ix_master_projects_status_created_at",
+    "ix_master_projects_live_status_created_at",
+]
+
+COLUMNS = [
+    ("master_projects", "budget_daily_base", "DOUBLE PRECISION"),
+    ("project_candidate_map", "daily_rate_base", "DOUBLE PRECISION"),
+    ("master_projects", "archived", "BOOLEAN NOT NULL DEFAULT false"),
+]
+
+TABLES = [
+    "CREATE TABLE IF NOT EXISTS currency_rates ("
+    "currency VARCHAR(10) PRIMARY KEY, rate_to_base DOUBLE PRECISION NOT NULL, modified_at TIMESTAMP)",
+    "CREATE TABLE IF NOT EXISTS project_tombstones (project_id INTEGER PRIMARY KEY, deleted_at TIMESTAMP NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS index_watermarks (name VARCHAR(64) PRIMARY KEY, value TIMESTAMP NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS loadtest_projects (project_id INTEGER PRIMARY KEY, created_at TIMESTAMP)",
+    "CREATE TABLE IF NOT EXISTS persisted_queries ("
+    "sha256 VARCHAR(64) PRIMARY KEY, document TEXT NOT NULL, created_at TIMESTAMP)",
+    # the default rule is seeded with the table only, so admins can clear every rule afterwards
+    "DO $$ BEGIN IF to_regclass('project_synonyms') IS NULL THEN "
+    "CREATE TABLE project_synonyms (id SERIAL PRIMARY KEY, rule TEXT, created_at TIMESTAMP); "
+    "INSERT INTO project_synonyms (rule, created_at) VALUES ('oil, petrol', timezone('utc', now())); "
+    "END IF; END $$",
+]
+
+# tables whose rows end up in the project ES document, a write bumps the parent's modified_at
+# so the delta reindex (delta_index.py) picks it up whatever path did the write
+TOUCH_PROJECT_TABLES = [
+    "project_candidate_map", "project_notes", "master_project_attribute_map", "project_team_members",
+    "project_directors",
+]
+
+# maintenance writes (cost recompute, archive backfill) set this for their transaction so they do not
+# bump modified_at, none of the columns they touch are in the ES document
+SKIP_TOUCH_SETTING = "projects.skip_modified_touch"
+
+TOUCH_EVENTS = [
+    ("ins", "INSERT", "NEW TABLE AS new_rows"),
+    ("upd", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    ("del", "DELETE", "OLD TABLE AS old_rows"),
+]
+
+TRIGGERS = [
+    "CREATE OR REPLACE FUNCTION set_project_modified_at() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP = 'INSERT' OR current_setting('" + SKIP_TOUCH_SETTING + "', true) IS DISTINCT FROM 'on' THEN "
+    "NEW.modified_at := timezone('utc', now()); END IF; RETURN NEW; END $$ LANGUAGE plpgsql",
+    # statement level, each distinct parent is updated once however many child rows the statement wrote
+    "CREATE OR REPLACE FUNCTION touch_master_projects() RETURNS trigger AS $$ BEGIN "
+    "IF current_setting('" + SKIP_TOUCH_SETTING + "', true) = 'on' THEN RETURN NULL; END IF; "
+    "IF TG_OP = 'INSERT' THEN "
+    "UPDATE master_projects SET modified_at = timezone('utc', now()) "
+    "WHERE id IN (SELECT DISTINCT project_id FROM new_rows); "
+    "ELSIF TG_OP = 'DELETE' THEN "
+    "UPDATE master_projects SET modified_at = timezone('utc', now()) "
+    "WHERE id IN (SELECT DISTINCT project_id FROM old_rows); "
+    "ELSE "
+    "UPDATE master_projects SET modified_at = timezone('utc', now()) "
+    "WHERE id IN (SELECT project_id FROM new_rows UNION SELECT project_id FROM old_rows); "
+    "END IF; RETURN NULL; END $$ LANGUAGE plpgsql",
+    "CREATE OR REPLACE FUNCTION tombstone_master_project() RETURNS trigger AS $$ BEGIN "
+    "INSERT INTO project_tombstones (project_id, deleted_at) VALUES (OLD.id, timezone('utc', now())) "
+    "ON CONFLICT (project_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at; RETURN NULL; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS master_projects_modified_at ON master_projects",
+    "CREATE TRIGGER master_projects_modified_at BEFORE INSERT OR UPDATE ON master_projects "
+    "FOR EACH ROW EXECUTE PROCEDURE set_project_modified_at()",
+    "DROP TRIGGER IF EXISTS master_projects_tombstone ON master_projects",
+    "CREATE TRIGGER master_projects_tombstone AFTER DELETE ON master_projects "
+    "FOR EACH ROW EXECUTE PROCEDURE tombstone_master_project()",
+] + [
+    # the earlier row level trigger
+    "DROP TRIGGER IF EXISTS {table}_touch_project ON {table}".format(table=table) for table in TOUCH_PROJECT_TABLES
+] + [
+    "DROP FUNCTION IF EXISTS touch_master_project()",
+] + [
+    sql.format(table=table, suffix=suffix, event=event, referencing=referencing)
+    for table in TOUCH_PROJECT_TABLES for suffix, event, referencing in TOUCH_EVENTS for sql in (
+        "DROP TRIGGER IF EXISTS {table}_touch_project_{suffix} ON {table}",
+        "CREATE TRIGGER {table}_touch_project_{suffix} AFTER {event} ON {table} REFERENCING {referencing} "
+        "FOR EACH STATEMENT EXECUTE PROCEDURE touch_master_projects()",
+    )
+]
+
+
+def notes_feed_query(session):
+    from .rows import note_rows_query
+    return note_rows_query(session, 1).limit(11)
+
+
+def notes_feed_after_query(session):
+    from .rows import note_rows_query, dated_notes_after
+    return dated_notes_after(note_rows_query(session, 1), datetime.datetime(2020, 1, 1), 1).limit(11)
+
+
+def projects_by_stage_query(session):
+    from .models import MasterProjectModel
+    from .archive import for_stage
+    from .rows import project_page_query
+    return project_page_query(for_stage(session.query(MasterProjectModel), 'Matching'), 0, 10)
+
+
+# queries from services.py / query.py that must not fall back to a seq scan. a callable builds the
+# query through the same ORM code the API runs, so the check sees the SQL that actually ships. the
+# flag marks ordered queries, which must come straight off an index without a Sort node
+PLAN_CHECKS = [
+    ("candidate by project and freelancer",
+     "SELECT id FROM project_candidate_map WHERE project_id = 1 AND freelancer_id = 1", False),
+    ("candidates for freelancer",
+     "SELECT id FROM project_candidate_map WHERE freelancer_id = 1", False),
+    ("project attributes",
+     "SELECT map_id FROM master_project_attribute_map WHERE project_id = 1 AND map_name = 'sector'", False),
+    ("projects for team member",
+     "SELECT project_id FROM project_team_members WHERE member_id = 1", False),
+    ("projects for director",
+     "SELECT project_id FROM project_directors WHERE director_id = 1", False),
+    ("notes feed for project", notes_feed_query, True),
+    ("notes feed after cursor", notes_feed_after_query, True),
+    ("projects by stage", projects_by_stage_query, True),
+    ("live projects count",
+     "SELECT count(id) FROM master_projects WHERE NOT archived", False),
+]
+
+
+def skip_modified_touch(session):
+    # transaction scoped, ends with the commit or rollback
+    session.execute(text("SELECT set_config(:name, 'on', true)"), {"name": SKIP_TOUCH_SETTING})
+
+
+def dedupe(conn, table, columns):
+    cols = ", ".join(columns)
+    conn.execute(text(
+        "DELETE FROM {table} t USING ("
+        "SELECT id, row_number() OVER (PARTITION BY {cols} ORDER BY id) AS rn FROM {table}"
+        ") d WHERE t.id = d.id AND d.rn > 1".format(table=table, cols=cols)
+    ))
+
+
+def find_duplicates(conn, table, columns):
+    cols = ", ".join(columns)
+    return conn.execute(text(
+        "SELECT {cols}, array_agg(id ORDER BY id) AS ids FROM {table} GROUP BY {cols} HAVING count(*) > 1".format(
+            table=table, cols=cols
+        )
+    )).fetchall()
+
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        for table, columns in DUPLICATE_CHECKS:
+            duplicates = find_duplicates(conn, table, columns)
+            for row in duplicates:
+                print(table, dict(row))
+            if duplicates:
+                raise RuntimeError("{} has {} duplicated ({}) groups, merge or delete them before upgrading".format(
+                    table, len(duplicates), ", ".join(columns)
+                ))
+        for sql in TABLES:
+            conn.execute(text(sql))
+        for table, column, column_type in COLUMNS:
+            conn.execute(text("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}".format(table, column, column_type)))
+        for table, columns in DEDUPE:
+            dedupe(conn, table, columns)
+        for sql in TRIGGERS:
+            conn.execute(text(sql))
+    # CONCURRENTLY cannot run inside a transaction block
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        for name, table, columns, unique, *where in INDEXES:
+            conn.execute(text("CREATE {}INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({}){}".format(
+                "UNIQUE " if unique else "", name, table, ", ".join(columns),
+                " WHERE " + where[0] if where else ""
+            )))
+        for name in DROPPED_INDEXES:
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name)))
+    finally:
+        conn.close()
+
+
+def downgrade(engine):
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        for name, *_ in reversed(INDEXES):
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name)))
+    finally:
+        conn.close()
+    with engine.begin() as conn:
+        for table in TOUCH_PROJECT_TABLES:
+            for suffix, _, _ in TOUCH_EVENTS:
+                conn.execute(text("DROP TRIGGER IF EXISTS {table}_touch_project_{suffix} ON {table}".format(
+                    table=table, suffix=suffix
+                )))
+        conn.execute(text("DROP TRIGGER IF EXISTS master_projects_modified_at ON master_projects"))
+        conn.execute(text("DROP TRIGGER IF EXISTS master_projects_tombstone ON master_projects"))
+        for name in ("touch_master_projects", "set_project_modified_at", "tombstone_master_project"):
+            conn.execute(text("DROP FUNCTION IF EXISTS {}()".format(name)))
+        for table, column, _ in COLUMNS:
+            conn.execute(text("ALTER TABLE {} DROP COLUMN IF EXISTS {}".format(table, column)))
+        for table in (
+            "currency_rates", "project_tombstones", "index_watermarks", "loadtest_projects", "project_synonyms",
+            "persisted_queries"
+        ):
+            conn.execute(text("DROP TABLE IF EXISTS {}".format(table)))
+
+
+def check_query_plans(engine, disable_seqscan=True):
+    # with enable_seqscan off the planner only picks a seq scan when no usable index exists,
+    # so this works on small dev databases too
+    failures = []
+    with engine.connect() as conn:
+        if disable_seqscan:
+            conn.execute(text("SET enable_seqscan = off"))
+        session = Session(bind=conn)
+        for name, check, ordered in PLAN_CHECKS:
+            if callable(check):
+                compiled = check(session).statement.compile(dialect=conn.dialect)
+                result = conn.execute("EXPLAIN " + str(compiled), compiled.params)
+            else:
+                result = conn.execute(text("EXPLAIN " + check))
+            plan = "\n".join(r[0] for r in result)
+            nodes = [line.strip().lstrip("-> ") for line in plan.splitlines()]
+            if "Seq Scan" in plan or (ordered and any(n.startswith("Sort") for n in nodes)):
+                failures.append((name, plan))
+        session.close()
+        if disable_seqscan:
+            conn.execute(text("RESET enable_seqscan"))
+    return failures
+
+
+def backfill_costs(session):
+    from .rates import recompute_candidate_rates, recompute_project_budgets
+    recompute_candidate_rates(session)
+    recompute_project_budgets(session)
+    session.commit()
+
+
+def backfill_archive(session):
+    from .archive import archive_closed_projects
+    counts = archive_closed_projects(session)
+    session.commit()
+    return counts
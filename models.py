@@ -1,6 +1,6 @@
 import datetime
 from utils.db import Base
-from sqlalchemy import ForeignKey, Column, Integer, Text, Boolean, String, Date, DateTime
+from sqlalchemy import ForeignKey, Column, Integer, Text, Boolean, String, Date, DateTime, Index, Float, text
 from sqlalchemy.orm import relationship, validates
 from utils.exceptions import InvalidRequest
 from freelancer_auth.models import FreelancerModel
@@ -19,6 +19,18 @@ BUDGET_UNIT = ['hour', 'day', 'week', 'month', 'year', 'project']
 
 class MasterProjectModel(Base):
     __tablename__ = "master_projects"
+    __table_args__ = (
+        # same order as the project list pages (rows.project_page_query), nulls last included
+        Index('ix_master_projects_status_created_desc', 'project_status', text('created_at DESC NULLS LAST'),
+              text('id DESC')),
+        Index('ix_master_projects_budget_daily_base', 'budget_daily_base'),
+        # live partition, closed Won/Lost projects are flagged archived and stay out of these
+        Index('ix_master_projects_live_status_created_desc', 'project_status', text('created_at DESC NULLS LAST'),
+              text('id DESC'), postgresql_where=text('NOT archived')),
+        Index('ix_master_projects_archived_closed_year', 'closed_year', 'created_at',
+              postgresql_where=text('archived')),
+        Index('ix_master_projects_modified_at', 'modified_at'),
+    )
     id = Column(Integer, primary_key=True)
     no_of_freelancers = Column(Integer)
     name = Column(String(255))
@@ -33,6 +45,8 @@ class MasterProjectModel(Base):
     budget_amount = Column(Integer)
     budget_unit = Column(String(255))
     budget_notes = Column(Text)
+    # budget per working day in rates.BASE_CURRENCY, maintained by rates.py
+    budget_daily_base = Column(Float, nullable=True)
     project_status = Column(String(255))
     admin_id = Column(Integer)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -58,6 +72,7 @@ class MasterProjectModel(Base):
     client_type = Column(String(255), nullable=True)
     closed_quarter = Column(String(255), nullable=True)
     closed_year = Column(String(4), nullable=True)
+    archived = Column(Boolean, nullable=False, default=False, server_default=text('false'))
 
     def update_attributes(self, session, map_name, map_values):
         print(map_name, map_values)
@@ -66,6 +81,7 @@ class MasterProjectModel(Base):
         table = MasterProjectAttributeMap.MAP[map_name]
 
         session.query(MasterProjectAttributeMap).filter_by(map_name=map_name, project_id=self.id).delete()
+        map_ids = set()
         for value in map_values:
             map_objs = session.query(table).filter_by(name=value).all()
             if not map_objs:
@@ -75,6 +91,9 @@ class MasterProjectModel(Base):
                 session.flush()
             else:
                 map_obj = map_objs[0]
+            if map_obj.id in map_ids:
+                continue
+            map_ids.add(map_obj.id)
             a = MasterProjectAttributeMap(map_name=map_name, map_id=map_obj.id, project_id=self.id)
             session.add(a)
         session.flush()
@@ -117,6 +136,11 @@ class MasterProjectAttributeMap(Base):
         "expertise": Skill
     }
     __tablename__ = 'master_project_attribute_map'
+    __table_args__ = (
+        # unique indexes rather than constraints, migrations.upgrade builds them CONCURRENTLY
+        Index('uq_master_project_attribute_map_project_map', 'project_id', 'map_name', 'map_id', unique=True),
+        Index('ix_master_project_attribute_map_project_map_name', 'project_id', 'map_name'),
+    )
 
     id = Column(Integer, primary_key=True)
     map_name = Column(String(100))
@@ -187,6 +211,10 @@ class ProjectResourcingModel(Base):
 
 class ProjectTeamMemberModel(Base):
     __tablename__ = "project_team_members"
+    __table_args__ = (
+        Index('uq_project_team_members_project_member', 'project_id', 'member_id', unique=True),
+        Index('ix_project_team_members_member_id', 'member_id'),
+    )
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey(MasterProjectModel.id))
     project = relationship(MasterProjectModel)
@@ -196,6 +224,10 @@ class ProjectTeamMemberModel(Base):
 
 class ProjectDirectorsModel(Base):
     __tablename__ = "project_directors"
+    __table_args__ = (
+        Index('uq_project_directors_project_director', 'project_id', 'director_id', unique=True),
+        Index('ix_project_directors_director_id', 'director_id'),
+    )
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey(MasterProjectModel.id))
     project = relationship(MasterProjectModel)
@@ -236,6 +268,11 @@ class ProjectClientModel(Base):
 
 class ProjectCandidateMapModel(Base):
     __tablename__ = "project_candidate_map"
+    __table_args__ = (
+        Index('uq_project_candidate_map_project_freelancer', 'project_id', 'freelancer_id', unique=True),
+        Index('ix_project_candidate_map_freelancer_id', 'freelancer_id'),
+        Index('ix_project_candidate_map_project_daily_rate', 'project_id', 'daily_rate_base'),
+    )
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey(MasterProjectModel.id))
     project = relationship(MasterProjectModel)
@@ -247,6 +284,8 @@ class ProjectCandidateMapModel(Base):
     rate_unit = Column(String(255))
     rate_currency = Column(String(255))
     rate_amount = Column(Integer)
+    # quote per working day in rates.BASE_CURRENCY, maintained by rates.py
+    daily_rate_base = Column(Float, nullable=True)
 
 
 class ProjectScaleMapModel(Base):
@@ -269,6 +308,11 @@ class ProjectCriteriaMapModel(Base):
 
 class ProjectNoteModel(Base):
     __tablename__ = 'project_notes'
+    __table_args__ = (
+        # same order as the notes feed (rows.note_rows_query), nulls last included
+        Index('ix_project_notes_project_created_desc', 'project_id', text('created_at DESC NULLS LAST'),
+              text('id DESC')),
+    )
 
     id = Column(Integer, primary_key=True)
     note = Column(Text)
@@ -277,3 +321,51 @@ class ProjectNoteModel(Base):
     admin_id = Column(Integer, ForeignKey(UserModel.id))
     admin = relationship(UserModel)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class ProjectSynonymModel(Base):
+    __tablename__ = 'project_synonyms'
+
+    id = Column(Integer, primary_key=True)
+    rule = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class CurrencyRateModel(Base):
+    __tablename__ = 'currency_rates'
+
+    currency = Column(String(10), primary_key=True)
+    # units of the base currency for one unit of this currency
+    rate_to_base = Column(Float, nullable=False)
+    modified_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class ProjectTombstoneModel(Base):
+    # written by the master_projects delete trigger, see migrations.TRIGGERS
+    __tablename__ = 'project_tombstones'
+
+    project_id = Column(Integer, primary_key=True)
+    deleted_at = Column(DateTime, nullable=False)
+
+
+class IndexWatermarkModel(Base):
+    __tablename__ = 'index_watermarks'
+
+    name = Column(String(64), primary_key=True)
+    value = Column(DateTime, nullable=False)
+
+
+class LoadTestProjectModel(Base):
+    # projects created by loadtest.DataGenerator, the harness only ever writes to these
+    __tablename__ = 'loadtest_projects'
+
+    project_id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class PersistedQueryModel(Base):
+    __tablename__ = 'persisted_queries'
+
+    sha256 = Column(String(64), primary_key=True)
+    document = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
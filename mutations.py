@@ -4,17 +4,15 @@ import datetime
 from utils.decorators import update_project
 from utils.authorization import verify_admin
 from utils.exceptions import InvalidRequest
-from utils.db import get_session
-from utils.ses import send_template_email
-from freelancer_profile.service import get_freelancer_email
-from location.query import PlaceInput
-from location.services import add_place
+from .routing import get_write_session
 from .models import MasterProjectModel
 from .serializers import index_project
-from .query import MasterProject, ProjectFeedback, ProjectCandidate
+from .query import MasterProject, ProjectFeedback, ProjectCandidate, ProjectSynonyms
+from .synonyms import set_synonyms, reload_worker
+from .rates import set_fx_rates
 from .services import (
     get_project_by_id, add_projection_location_details, add_project_resourcing, add_project_scope_link, add_project_scope_file, map_project_client,
-    add_project_candidate, add_project_candidates, update_project_settings, get_candidates_with_id, reject_project_candidate, edit_project_candidate,
+    add_project_candidate, add_project_candidates, bulk_add_project_candidates, bulk_transition_candidates, get_missing_project_ids, update_project_settings, get_candidates_with_id, reject_project_candidate, edit_project_candidate,
     set_project_criterias, set_project_scales, clear_project_scope_links, clear_project_scope_files,
     add_stakeholder, add_team_member, add_director, add_freelancer_note, add_project_note, clear_project_members,
     clear_project_directors, clear_project_stakeholders, update_candidate_quote, edit_freelancer_note, delete_freelancer_note,
@@ -29,6 +27,11 @@ class FileInput(graphene.InputObjectType):
     is_scope = graphene.Boolean()
 
 
+class CurrencyRateInput(graphene.InputObjectType):
+    currency = graphene.String()
+    rate_to_base = graphene.Float()
+
+
 class AddMasterProject(graphene.Mutation):
     class Arguments:
         token = graphene.String()
@@ -55,7 +58,7 @@ class AddMasterProject(graphene.Mutation):
         scope_links = graphene.List(FileInput)
         id = graphene.Int(required=False)
         project_status = graphene.String(required=False)
-        location = graphene.Argument(PlaceInput, required=False)
+        location = graphene.Argument('location.query.PlaceInput', required=False)
         freelancer_location_type = graphene.String()
         educational_background = graphene.String()
         project_start_date = graphene.Date(required=False)
@@ -70,6 +73,7 @@ class AddMasterProject(graphene.Mutation):
     project = graphene.Field(MasterProject)
 
     def mutate(self, info, *args, **kwargs):
+        from location.services import add_place
         token = kwargs.pop('token')
         if kwargs.get('project_type', "") == 'freelance' and not kwargs.get('no_of_freelancers', None):
             raise InvalidRequest("Number of freelancers not provided")
@@ -90,7 +94,7 @@ class AddMasterProject(graphene.Mutation):
         scope_links = kwargs.pop('scope_links', [])
         location = kwargs.pop('location', None)
         user = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
 
         # if len(scope_files) == 0 and len(scope_links) == 0:
         #     raise InvalidRequest("A project scope link or file is required")
@@ -140,9 +144,15 @@ class AddMasterProject(graphene.Mutation):
             project.location_id = add_place(session, location)
             project.city = location.city
             project.country = location.country
-        project = get_project_by_id(session, project.id)
+        project_id = project.id
         session.commit()
-        index_project(project.id)
+        index_project(project_id)
+        from .matching import project_written
+        from .similarity import index_project_signature
+        project_written(session, project_id)
+        index_project_signature(session, project_id)
+        project = get_project_by_id(session, project_id)
+        session.close()
         return AddMasterProject(project=MasterProject(project))
 
 
@@ -172,7 +182,7 @@ class AddMasterProjectLocation(graphene.Mutation):
 
     def mutate(self, info, *args, **kwargs):
         verify_admin(kwargs['token'])
-        session = get_session()
+        session = get_write_session()
         print("called mutate")
         project = get_project_by_id(session, kwargs['project_id'])
         if not project:
@@ -200,7 +210,7 @@ class AddMasterProjectResourcing(graphene.Mutation):
 
     def mutate(self, info, *args, **kwargs):
         verify_admin(kwargs['token'])
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, kwargs['project_id'])
         if not project:
             raise InvalidRequest("Project not found")
@@ -228,7 +238,7 @@ class AddMasterProjectScopeLink(graphene.Mutation):
 
     def mutate(self, info, token, project_id, docs):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, project_id)
         if not project:
             raise InvalidRequest("Project not found")
@@ -251,7 +261,7 @@ class AddMasterProjectScopeFiles(graphene.Mutation):
 
     def mutate(self, info, token, project_id, links):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, project_id)
         if not project:
             raise InvalidRequest("Project not found")
@@ -275,7 +285,7 @@ class AddMasterProjectClient(graphene.Mutation):
 
     def mutate(self, info, token, project_id, client_id, stakeholder_id):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, project_id)
         if not project:
             raise InvalidRequest("Project not found")
@@ -296,11 +306,11 @@ class AddMasterProjectCandidate(graphene.Mutation):
 
     def mutate(self, info, token, project_ids, freelancer_id):
         verify_admin(token)
-        session = get_session()
-        for project_id in project_ids:
-            project = get_project_by_id(session, project_id)
-            if not project:
-                raise InvalidRequest("Project id {} not found".format(project_id))
+        session = get_write_session()
+        missing = get_missing_project_ids(session, project_ids)
+        if missing:
+            session.close()
+            raise InvalidRequest("Project id {} not found".format(missing[0]))
         add_project_candidates(session, project_ids, freelancer_id)
         session.commit()
         projects = ProjectCandidate.freelancer_projects(token=token, freelancer_id=freelancer_id)
@@ -308,6 +318,30 @@ class AddMasterProjectCandidate(graphene.Mutation):
         return AddMasterProjectCandidate(candidates=[p for p in projects if p.obj.project_id in project_ids])
 
 
+class BulkAddMasterProjectCandidates(graphene.Mutation):
+    class Arguments:
+        token = graphene.String()
+        project_ids = graphene.List(graphene.Int)
+        freelancer_ids = graphene.List(graphene.Int)
+        stage = graphene.String(default_value="Longlist")
+
+    candidates = graphene.List(ProjectCandidate)
+
+    def mutate(self, info, token, project_ids, freelancer_ids, stage="Longlist"):
+        verify_admin(token)
+        session = get_write_session()
+        try:
+            candidate_ids = [c.id for c in bulk_add_project_candidates(session, project_ids, freelancer_ids, stage)]
+            session.commit()
+            candidates = get_candidates_with_id(session, candidate_ids) if candidate_ids else []
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return BulkAddMasterProjectCandidates(candidates=[ProjectCandidate(c) for c in candidates])
+
+
 class EditMasterProjectSettings(graphene.Mutation):
     class Arguments:
         token = graphene.String()
@@ -318,7 +352,7 @@ class EditMasterProjectSettings(graphene.Mutation):
 
     def mutate(self, info, token, project_id, hiring_stage_id):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, project_id)
         if not project:
             raise InvalidRequest("Project not found")
@@ -350,7 +384,7 @@ class EditMasterProjectStage(graphene.Mutation):
         verify_admin(token)
         if stage not in allowed_stage_values:
             raise InvalidRequest("Invalid stage value, allowed values are - " + str(allowed_stage_values))
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, project_id)
         if not project:
             raise InvalidRequest("Project not found")
@@ -370,7 +404,9 @@ class SendBulkEmail(graphene.Mutation):
     message = graphene.String()
 
     def mutate(self, info, token, subject, body, candidates):
-        session = get_session()
+        from utils.ses import send_template_email
+        from freelancer_profile.service import get_freelancer_email
+        session = get_write_session()
         candidates = get_candidates_with_id(session, candidates)
         emails = [get_freelancer_email(session, c.freelancer_id) for c in candidates]
         for email in emails:
@@ -389,7 +425,7 @@ class RejectMasterProjectCandidates(graphene.Mutation):
 
     def mutate(self, info, token, project_id, candidate_ids):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         reject_project_candidate(session, candidate_ids)
         session.commit()
         session.close()
@@ -411,7 +447,7 @@ class EditMasterProjectCandidate(graphene.Mutation):
     @update_project
     def mutate(self, info, token, project_id, candidate_id, **kwargs):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         print(candidate_id)
         kwargs['stage'] = kwargs.pop('status', None)
         edit_project_candidate(session, candidate_id, **kwargs)
@@ -420,6 +456,31 @@ class EditMasterProjectCandidate(graphene.Mutation):
         return EditMasterProjectCandidate(master_project=MasterProject.detail(token=token, id=project_id))
 
 
+class BulkEditCandidateStage(graphene.Mutation):
+    class Arguments:
+        token = graphene.String()
+        project_id = graphene.Int()
+        candidate_ids = graphene.List(graphene.Int)
+        stage = graphene.String()
+
+    updated_candidates = graphene.Int()
+    updated_freelancers = graphene.Int()
+
+    @update_project
+    def mutate(self, info, token, project_id, candidate_ids, stage):
+        verify_admin(token)
+        session = get_write_session()
+        try:
+            candidates, freelancers = bulk_transition_candidates(session, candidate_ids, stage, project_id)
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return BulkEditCandidateStage(updated_candidates=candidates, updated_freelancers=freelancers)
+
+
 class EditMasterProjectFeedback(graphene.Mutation):
     class Arguments:
         token = graphene.String()
@@ -431,7 +492,7 @@ class EditMasterProjectFeedback(graphene.Mutation):
 
     def mutate(self, info, token, project_id, scale_ids, criteria_ids):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         project = get_project_by_id(session, project_id)
         if not project:
             raise InvalidRequest("Project not found")
@@ -439,7 +500,7 @@ class EditMasterProjectFeedback(graphene.Mutation):
         set_project_scales(session, project_id, scale_ids)
         session.commit()
         session.close()
-        return EditMasterProjectFeedback(feedback_form=ProjectFeedback(project_id=project_id, token=token))
+        return EditMasterProjectFeedback(feedback_form=ProjectFeedback.detail(project_id=project_id, token=token))
 
 
 class AddFreelancerNote(graphene.Mutation):
@@ -454,7 +515,7 @@ class AddFreelancerNote(graphene.Mutation):
     @update_freelancer
     def mutate(self, info, token, note, freelancer_id, **kwargs):
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         add_freelancer_note(session, freelancer_id, admin.id, note, kwargs.get('project_id', None))
         session.commit()
         session.close()
@@ -471,7 +532,7 @@ class EditFreelancerNote(graphene.Mutation):
 
     def mutate(self, info, token, note_id, note, **kwargs):
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         edit_freelancer_note(session, admin.id, note_id, note)
         session.commit()
         session.close()
@@ -487,7 +548,7 @@ class DeleteFreelancerNote(graphene.Mutation):
 
     def mutate(self, info, token, note_id, **kwargs):
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         delete_freelancer_note(session, admin.id, note_id)
         session.commit()
         session.close()
@@ -505,7 +566,7 @@ class AddProjectNote(graphene.Mutation):
     @update_project
     def mutate(self, info, token, note, project_id):
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         add_project_note(session, admin.id, note, project_id)
         session.commit()
         session.close()
@@ -524,7 +585,7 @@ class EditProjectNote(graphene.Mutation):
     @update_project
     def mutate(self, info, token, note, note_id):
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         edit_project_note(session, admin.id, note_id, note)
         session.commit()
         session.close()
@@ -541,7 +602,7 @@ class DeleteProjectNote(graphene.Mutation):
     @update_project
     def mutate(self, info, token, note_id):
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         delete_project_note(session, admin.id, note_id)
         session.commit()
         session.close()
@@ -558,11 +619,15 @@ class DeleteProject(graphene.Mutation):
     @update_project
     def mutate(self, info, token, project_id):
         from freelancer_new.services import delete_project
+        from .matching import project_deleted
+        from .similarity import remove_project_signature
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         delete_project(session,project_id)
         session.commit()
         session.close()
+        project_deleted(project_id)
+        remove_project_signature(project_id)
         return DeleteProject(message="deleted the project")
 
 
@@ -577,7 +642,7 @@ class DeleteFreelancer(graphene.Mutation):
     def mutate(self, info, token, freelancer_id):
         from freelancer_new.services import delete_freelancer
         admin = verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         delete_freelancer(session, freelancer_id)
         session.commit()
         session.close()
@@ -598,8 +663,47 @@ class EditCandidateQuote(graphene.Mutation):
     @update_project
     def mutate(self, info, token, project_id, freelancer_id, **kwargs):
         verify_admin(token)
-        session = get_session()
+        session = get_write_session()
         update_candidate_quote(session, project_id, freelancer_id, **kwargs)
         session.commit()
         session.close()
         return EditCandidateQuote(projects=ProjectCandidate.freelancer_projects(token=token, freelancer_id=freelancer_id))
+
+
+class EditProjectSynonyms(graphene.Mutation):
+    class Arguments:
+        token = graphene.String()
+        synonyms = graphene.List(graphene.String)
+
+    synonyms = graphene.Field(ProjectSynonyms)
+
+    def mutate(self, info, token, synonyms):
+        verify_admin(token)
+        session = get_write_session()
+        synonyms = set_synonyms(session, synonyms)
+        session.commit()
+        session.close()
+        # the index copy runs in the background, searches keep the old rules until the alias moves
+        reload_worker.submit()
+        return EditProjectSynonyms(synonyms=ProjectSynonyms(synonyms=synonyms))
+
+
+class EditCurrencyRates(graphene.Mutation):
+    class Arguments:
+        token = graphene.String()
+        rates = graphene.List(CurrencyRateInput)
+
+    changed_currencies = graphene.List(graphene.String)
+
+    def mutate(self, info, token, rates):
+        verify_admin(token)
+        session = get_write_session()
+        try:
+            changed = set_fx_rates(session, {r.currency: r.rate_to_base for r in rates})
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return EditCurrencyRates(changed_currencies=changed)
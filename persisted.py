@@ -0,0 +1,113 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.language.parser import parse
+from graphql.validation import validate
+from .models import PersistedQueryModel
+
+
+# reject hashes that were not registered ahead of time instead of learning them from clients
+PERSISTED_ONLY = os.environ.get("PROJECT_PERSISTED_QUERIES_ONLY", "").lower() in ("1", "true", "yes")
+CACHE_SIZE = 500
+
+
+def document_hash(document):
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+
+class PersistedQueryRegistry(object):
+    def __init__(self, schema, persisted_only=PERSISTED_ONLY, cache_size=CACHE_SIZE):
+        self.schema = schema
+        self.persisted_only = persisted_only
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached(self, sha):
+        with self.lock:
+            ast = self.cache.get(sha)
+            if ast is not None:
+                self.cache.move_to_end(sha)
+            return ast
+
+    def remember(self, sha, ast):
+        with self.lock:
+            self.cache[sha] = ast
+            self.cache.move_to_end(sha)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def compile(self, document):
+        ast = parse(document)
+        errors = validate(self.schema, ast)
+        if errors:
+            raise errors[0] if len(errors) == 1 else GraphQLError("; ".join(e.message for e in errors))
+        return ast
+
+    def load_document(self, sha):
+        from .routing import get_session
+        session = get_session()
+        row = session.query(PersistedQueryModel).filter_by(sha256=sha).scalar()
+        session.close()
+        return row.document if row else None
+
+    def register(self, document, sha=None):
+        sha = sha or document_hash(document)
+        if sha != document_hash(document):
+            raise GraphQLError("provided sha256Hash does not match query")
+        ast = self.compile(document)
+        from .routing import get_write_session
+        session = get_write_session()
+        if not session.query(PersistedQueryModel).filter_by(sha256=sha).scalar():
+            session.add(PersistedQueryModel(sha256=sha, document=document))
+            session.commit()
+        session.close()
+        self.remember(sha, ast)
+        return sha
+
+    def resolve(self, sha, document=None):
+        ast = self.cached(sha)
+        if ast is not None:
+            return ast
+        stored = self.load_document(sha)
+        if stored is not None:
+            ast = self.compile(stored)
+            self.remember(sha, ast)
+            return ast
+        if document is None:
+            raise GraphQLError("PersistedQueryNotFound")
+        if self.persisted_only:
+            raise GraphQLError("PersistedQueryNotSupported")
+        self.register(document, sha)
+        return self.cached(sha)
+
+    def execute(self, payload, context=None, root=None, analyzer=None, **kwargs):
+        extensions = payload.get('extensions') or {}
+        sha = (extensions.get('persistedQuery') or {}).get('sha256Hash') or payload.get('id')
+        document = payload.get('query')
+        try:
+            if sha:
+                ast = self.resolve(sha, document)
+            elif self.persisted_only:
+                raise GraphQLError("PersistedQueryNotSupported")
+            else:
+                ast = self.compile(document or "")
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        if analyzer is not None:
+            from .cost import execute_checked
+            return execute_checked(
+                self.schema, ast, analyzer, payload.get('variables') or {}, payload.get('operationName'),
+                root=root, context=context, **kwargs
+            )
+        from .routing import with_routing
+        kwargs['middleware'] = with_routing(kwargs.get('middleware'))
+        return execute(
+            self.schema, ast, root, context,
+            variables=payload.get('variables') or {},
+            operation_name=payload.get('operationName'),
+            **kwargs
+        )
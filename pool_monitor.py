@@ -0,0 +1,225 @@
+import time
+import threading
+import traceback
+import contextlib
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+
+LEAK_AGE_SECONDS = 30
+
+
+class SessionLeakError(Exception):
+    pass
+
+
+class WaitStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def record(self, elapsed, timed_out=False):
+        with self.lock:
+            self.count += 1
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "wait_count": self.count,
+                "wait_avg": self.total / self.count if self.count else 0.0,
+                "wait_max": self.max,
+                "timeouts": self.timeouts,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    # create_engine(url, poolclass=TimedQueuePool). the pool events fire once a connection is handed out,
+    # the wait for a free one is only visible from inside the pool
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self.wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - started)
+        return conn
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool, the numbers carry over
+        pool = super(TimedQueuePool, self).recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+class PoolMonitor(object):
+    def __init__(self, engine, leak_age=LEAK_AGE_SECONDS):
+        self.engine = engine
+        self.pool = engine.pool
+        self.leak_age = leak_age
+        self.lock = threading.Lock()
+        self.checked_out = {}
+        # sessions of this engine holding a transaction, and so a connection, keyed by id(session)
+        self.sessions = {}
+        self.checkouts = 0
+        # above pool_size means requests ran into the overflow, callers past that wait for a checkin
+        self.peak_checked_out = 0
+        self.reported = set()
+
+    def install(self):
+        if not isinstance(self.pool, TimedQueuePool):
+            print("pool monitor: {} is not a TimedQueuePool, checkout waits are not measured".format(
+                type(self.pool).__name__
+            ))
+        event.listen(self.pool, 'checkout', self.on_checkout)
+        event.listen(self.pool, 'checkin', self.on_checkin)
+        event.listen(Session, 'after_begin', self.on_session_begin)
+        event.listen(Session, 'after_transaction_end', self.on_session_end)
+        return self
+
+    def uninstall(self):
+        event.remove(self.pool, 'checkout', self.on_checkout)
+        event.remove(self.pool, 'checkin', self.on_checkin)
+        event.remove(Session, 'after_begin', self.on_session_begin)
+        event.remove(Session, 'after_transaction_end', self.on_session_end)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        stack = traceback.extract_stack()[:-1]
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out[id(connection_record)] = (time.time(), threading.current_thread().name, stack)
+            self.peak_checked_out = max(self.peak_checked_out, len(self.checked_out))
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        key = id(connection_record)
+        with self.lock:
+            self.checked_out.pop(key, None)
+            self.reported.discard(key)
+
+    def on_session_begin(self, session, transaction, connection):
+        if connection.engine is not self.engine:
+            return
+        stack = traceback.extract_stack()[:-1]
+        with self.lock:
+            self.sessions.setdefault(id(session), (time.time(), threading.current_thread().name, stack))
+
+    def on_session_end(self, session, transaction):
+        # nested and sub transactions end inside the outer one, only the outermost releases the connection
+        if transaction.parent is None:
+            with self.lock:
+                self.sessions.pop(id(session), None)
+
+    def stats(self):
+        wait_stats = getattr(self.pool, 'wait_stats', None)
+        waits = wait_stats.snapshot() if wait_stats else dict.fromkeys(WaitStats().snapshot())
+        with self.lock:
+            stats = {
+                "pool_size": self.pool.size() if hasattr(self.pool, 'size') else None,
+                "checked_out": len(self.checked_out),
+                "overflow": self.pool.overflow() if hasattr(self.pool, 'overflow') else None,
+                "open_sessions": len(self.sessions),
+                "checkouts": self.checkouts,
+                "peak_checked_out": self.peak_checked_out,
+            }
+        stats.update(waits)
+        return stats
+
+    def leaks(self, max_age=None):
+        max_age = self.leak_age if max_age is None else max_age
+        now = time.time()
+        with self.lock:
+            return [
+                {
+                    "age": now - checked_out_at,
+                    "thread": thread_name,
+                    "stack": "".join(traceback.format_list(stack))
+                }
+                for checked_out_at, thread_name, stack in self.checked_out.values()
+                if now - checked_out_at >= max_age
+            ]
+
+    def report_leaks(self, max_age=None):
+        max_age = self.leak_age if max_age is None else max_age
+        now = time.time()
+        with self.lock:
+            fresh = [
+                (key, entry) for key, entry in self.checked_out.items()
+                if key not in self.reported and now - entry[0] >= max_age
+            ]
+            self.reported.update(key for key, _ in fresh)
+        for _, (checked_out_at, thread_name, stack) in fresh:
+            print("connection checked out for {:.1f}s by thread {}, checked out at:\n{}".format(
+                now - checked_out_at, thread_name, "".join(traceback.format_list(stack))
+            ))
+        return len(fresh)
+
+    def start_reporter(self, interval=10):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.report_leaks()
+        thread = threading.Thread(target=run, name="pool-leak-reporter", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot_keys(self):
+        with self.lock:
+            return set(self.sessions), set(self.checked_out)
+
+    def check_no_leaks(self, since=(set(), set())):
+        sessions_before, connections_before = since
+        with self.lock:
+            sessions = [entry for key, entry in self.sessions.items() if key not in sessions_before]
+            connections = [entry for key, entry in self.checked_out.items() if key not in connections_before]
+        # a session names the code that used it, report that before the bare connection
+        if sessions:
+            raise SessionLeakError("{} session(s) left open, first began at:\n{}".format(
+                len(sessions), "".join(traceback.format_list(sessions[0][2]))
+            ))
+        if connections:
+            raise SessionLeakError("{} connection(s) not returned to the pool, first checked out at:\n{}".format(
+                len(connections), "".join(traceback.format_list(connections[0][2]))
+            ))
+
+
+@contextlib.contextmanager
+def fail_on_leak(monitor=None):
+    # test mode: raises if the wrapped block leaves a session open or a connection checked out
+    monitor = monitor or _monitor
+    if monitor is None:
+        raise RuntimeError("pool_monitor.install() has not run, pass a monitor or install one first")
+    before = monitor.snapshot_keys()
+    yield monitor
+    monitor.check_no_leaks(before)
+
+
+_monitor = None
+
+
+def install(engine=None, leak_age=LEAK_AGE_SECONDS, report_interval=None):
+    global _monitor
+    if engine is None:
+        from utils.db import get_session
+        session = get_session()
+        engine = session.get_bind()
+        session.close()
+    _monitor = PoolMonitor(engine, leak_age).install()
+    if report_interval:
+        _monitor.start_reporter(report_interval)
+    return _monitor
+
+
+def get_monitor():
+    return _monitor
@@ -1,25 +1,22 @@
 import graphene
 import os
-import datetime
-from sqlalchemy.orm import joinedload
-from utils.db import get_session
 from utils.string_utils import lower_plain_str
 from utils.authorization import verify_admin, verify_freelancer
 from utils.exceptions import InvalidRequest
-from utils.elapsed import elapsed_time_str
-from admin.api import Admin
-from clients.query import ClientMaster, POC
-from clients.services import fetch_client
-from freelancer_profile.api import Freelancer, load_freelancer
 from freelancer_auth.models import FreelancerModel
 from process.models import TemplateModel, StageModel
-from location.query import Place
-from process.api import Template
-from scales.api import Scale, ScaleCritera
-from .models import MasterProjectModel, ProjectSegmentModel, ProjectSubSegmentModel, ProjectRatingCriteriaModel, ProjectCandidateMapModel, ProjectDirectorsModel, ProjectTeamMemberModel
+from .routing import get_session
+from .archive import for_stage, count_live_projects
+from .feedback import get_feedback_form
+from .models import MasterProjectModel, ProjectSegmentModel, ProjectSubSegmentModel, ProjectRatingCriteriaModel, ProjectDirectorsModel, ProjectTeamMemberModel
 from .services import (
-    get_project_by_id, get_project_resourcing, get_project_members, get_project_client_map, get_candidates_for_freelancer, get_project_criterias,
-    get_project_scales, get_project_location_details
+    get_project_by_id, get_project_resourcing, get_project_members, get_project_client_map,
+    get_project_location_details, get_projects_for_freelancer
+)
+from .rows import (
+    PROJECT_SMALL_COLUMNS, ProjectRow, ProjectPage, get_project_rows, page_project_rows,
+    get_candidate_rows, get_candidate_rows_for_freelancer, get_candidate_stage_counts, get_note_rows,
+    encode_note_cursor, get_assigned_freelancer_ids
 )
 
 
@@ -46,12 +43,13 @@ class ProjectSmall(graphene.ObjectType):
     project_stage = graphene.String()
     expertise = graphene.List(MasterProjectAttribute)
     sectors = graphene.List(MasterProjectAttribute)
-    hiring_stages = graphene.Field(Template)
+    hiring_stages = graphene.Field('process.api.Template')
 
-    def __init__(self, obj, assigned=False, stage=None):
+    def __init__(self, obj, assigned=False, stage=None, client_name=None):
         self.obj = obj
         self.assigned = assigned
         self.candidate_status = stage
+        self.client_name = client_name
 
     def resolve_id(self, info):
         return self.obj.id
@@ -69,19 +67,20 @@ class ProjectSmall(graphene.ObjectType):
         return "Matching" if not self.obj.project_status else self.obj.project_status
 
     def resolve_client_name(self, info):
+        from clients.services import fetch_client
+        if self.client_name is not None:
+            return self.client_name
         session = get_session()
         client = fetch_client(session, self.obj.client_id)
         session.close()
         return client.name if client else ""
 
     def resolve_hiring_stages(self, info, *args, **kwargs):
+        from process.api import Template
         session = get_session()
         t = session.query(TemplateModel).filter_by(id=1).scalar()
-        if t:
-            return Template(t)
-        else:
-            return None
         session.close()
+        return Template(t) if t else None
 
     def resolve_expertise(self, info, *args, **kwargs):
         session = get_session()
@@ -101,14 +100,14 @@ class ProjectSmall(graphene.ObjectType):
         verify_admin(kwargs['token'])
         freelancer_id = kwargs['freelancer_id']
         session = get_session()
-        candidates = get_candidates_for_freelancer(session, freelancer_id)
+        candidates = get_candidate_rows_for_freelancer(session, freelancer_id)
         project_map = {c.project_id: c.stage for c in candidates}
         q = lower_plain_str(kwargs.get("q", ""))
         start = kwargs.get("start", 0)
         end = kwargs.get("end", 10)
         hits = search(q, "project", fields=['ac_search_field']).hits[start:end]
         ids = [h.id for h in hits]
-        projects = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids)).all()
+        projects = get_project_rows(session, ids, PROJECT_SMALL_COLUMNS)
         ans = [ProjectSmall(p, p.id in project_map, project_map.get(p.id, None)) for p in projects]
         session.close()
         return ans
@@ -116,7 +115,7 @@ class ProjectSmall(graphene.ObjectType):
 
 class ProjectCandidate(graphene.ObjectType):
     id = graphene.Int()
-    freelancer = graphene.Field(Freelancer)
+    freelancer = graphene.Field('freelancer_profile.api.Freelancer')
     added_on = graphene.DateTime()
     status = graphene.String()
     rate_unit = graphene.String()
@@ -145,6 +144,7 @@ class ProjectCandidate(graphene.ObjectType):
         return self.obj.rate_amount
 
     def resolve_freelancer(self, info):
+        from freelancer_profile.api import Freelancer, load_freelancer
         session = get_session()
         freelancer = load_freelancer(session, self.obj.freelancer_id)
         session.close()
@@ -158,9 +158,9 @@ class ProjectCandidate(graphene.ObjectType):
 
     def resolve_project(self, info):
         session = get_session()
-        project = get_project_by_id(session, self.obj.project_id)
+        projects = get_project_rows(session, [self.obj.project_id], PROJECT_SMALL_COLUMNS)
         session.close()
-        return ProjectSmall(project)
+        return ProjectSmall(projects[0]) if projects else None
 
     @staticmethod
     def freelancer_projects(*args, **kwargs):
@@ -171,7 +171,7 @@ class ProjectCandidate(graphene.ObjectType):
             freelancer, _ = verify_freelancer(kwargs['token'])
             freelancer_id = freelancer.id
         session = get_session()
-        candidates = get_candidates_for_freelancer(session, freelancer_id)
+        candidates = get_candidate_rows_for_freelancer(session, freelancer_id)
         session.close()
         return [ProjectCandidate(c) for c in candidates]
 
@@ -221,16 +221,18 @@ class ScopeLink(graphene.ObjectType):
 
 
 class ClientMap(graphene.ObjectType):
-    client = graphene.Field(ClientMaster)
-    stakeholder = graphene.Field(POC)
+    client = graphene.Field('clients.query.ClientMaster')
+    stakeholder = graphene.Field('clients.query.POC')
 
     def __init__(self, obj):
         self.obj = obj
 
     def resolve_client(self, info):
+        from clients.query import ClientMaster
         return ClientMaster(self.obj.client)
 
     def resolve_stakeholder(self, info):
+        from clients.query import POC
         return POC(self.obj.stakeholder)
 
 
@@ -252,9 +254,9 @@ class ProjectResourcing(graphene.ObjectType):
     segment = graphene.Field(ResourceConstant)
     rating_criteria = graphene.Field(ResourceConstant)
     sub_segment = graphene.Field(ResourceConstant)
-    director = graphene.Field(Admin)
-    lead = graphene.Field(Admin)
-    members = graphene.List(Admin)
+    director = graphene.Field('admin.api.Admin')
+    lead = graphene.Field('admin.api.Admin')
+    members = graphene.List('admin.api.Admin')
     notes = graphene.String()
 
     def __init__(self, obj, members):
@@ -274,12 +276,15 @@ class ProjectResourcing(graphene.ObjectType):
         return self.obj.notes
 
     def resolve_director(self, info):
+        from admin.api import Admin
         return Admin(self.obj.director)
 
     def resolve_lead(self, info):
+        from admin.api import Admin
         return Admin(self.obj.lead)
 
     def resolve_members(self, info):
+        from admin.api import Admin
         return [Admin(m.member) for m in self.member_objs]
 
 
@@ -370,6 +375,9 @@ class ProjectNote(graphene.ObjectType):
         return self.obj.id
 
     def resolve_created_by(self, info, *args, **kwargs):
+        author_email = getattr(self.obj, 'author_email', None)
+        if author_email:
+            return author_email.split("@")[0]
         from auth.models import UserModel
         session = get_session()
         user = session.query(UserModel).filter_by(id=self.obj.admin_id).scalar()
@@ -380,9 +388,16 @@ class ProjectNote(graphene.ObjectType):
         return self.obj.note
 
     def resolve_time_elapsed(self, info, *args, **kwargs):
+        from utils.elapsed import elapsed_time_str
         return elapsed_time_str(self.obj.created_at)
 
 
+class ProjectNoteConnection(graphene.ObjectType):
+    notes = graphene.List(ProjectNote)
+    next_cursor = graphene.String()
+    has_more = graphene.Boolean()
+
+
 class CandidateCount(graphene.ObjectType):
     count = graphene.Int()
     stage_id = graphene.Int()
@@ -445,14 +460,14 @@ class MasterProject(graphene.ObjectType):
     closed_year = graphene.String()
     modified_at = graphene.String()
     no_of_freelancers = graphene.Int()
-    location = graphene.Field(Place)
+    location = graphene.Field('location.query.Place')
     name = graphene.String()
     project_type = graphene.String()
     background = graphene.String()
     notes = graphene.String()
-    hiring_stages = graphene.Field(Template)
+    hiring_stages = graphene.Field('process.api.Template')
     client_id = graphene.Int()
-    client = graphene.Field(ClientMaster)
+    client = graphene.Field('clients.query.ClientMaster')
     duration_unit = graphene.String()
     duration_count = graphene.Int()
     budget_currency = graphene.String()
@@ -465,9 +480,9 @@ class MasterProject(graphene.ObjectType):
     sectors = graphene.List(MasterProjectAttribute)
     scope_files = graphene.List(graphene.String)
     scope_links = graphene.List(ScopeLink)
-    members = graphene.List(Admin)
-    directors = graphene.List(Admin)
-    stakeholders = graphene.List(POC)
+    members = graphene.List('admin.api.Admin')
+    directors = graphene.List('admin.api.Admin')
+    stakeholders = graphene.List('clients.query.POC')
     project_stage = graphene.String()
     candidates = graphene.List(
         ProjectCandidate,
@@ -475,10 +490,16 @@ class MasterProject(graphene.ObjectType):
         end=graphene.Int(default_value=9),
         status=graphene.String(default_value="All"),
         sort=graphene.String(default_value=None),
+        within_budget=graphene.Boolean(default_value=False),
     )
     total_candidates = graphene.Int()
     candidate_counts = graphene.List(CandidateCount)
     note_list = graphene.List(ProjectNote)
+    note_feed = graphene.Field(
+        ProjectNoteConnection,
+        first=graphene.Int(default_value=10),
+        after=graphene.String(default_value=None),
+    )
     freelancer_location_type = graphene.String()
     educational_background = graphene.String()
     project_start_date = graphene.String()
@@ -486,6 +507,9 @@ class MasterProject(graphene.ObjectType):
     sub_segment = graphene.String()
     is_client_confidential = graphene.Boolean()
     sharepoint_link = graphene.String()
+    # only set by all_for_freelancer, from the project_candidate_map row of that freelancer
+    assigned = graphene.Boolean()
+    candidate_status = graphene.String()
 
     def __init__(self, obj, config=dict(), score=0):
         self.obj = obj
@@ -517,6 +541,7 @@ class MasterProject(graphene.ObjectType):
         return user.name if user.name else user.email.split("@")[0]
 
     def resolve_location(self, info, *args, **kwargs):
+        from location.query import Place
         if not self.obj.location_id:
             return None
         session = get_session()
@@ -531,16 +556,17 @@ class MasterProject(graphene.ObjectType):
         return self.obj.modified_at.strftime("%d %B %Y, %I:%M %p") if self.obj.modified_at else ""
 
     def resolve_total_candidates(self, info, *args, **kwargs):
-        return len(self.obj.candidates)
+        session = get_session()
+        counts = get_candidate_stage_counts(session, self.obj.id)
+        session.close()
+        return sum(counts.values())
 
     def resolve_hiring_stages(self, info, *args, **kwargs):
+        from process.api import Template
         session = get_session()
         t = session.query(TemplateModel).filter_by(id=1).scalar()
-        if t:
-            return Template(t)
-        else:
-            return None
         session.close()
+        return Template(t) if t else None
 
     def resolve_no_of_freelancers(self, info, *args, **kwargs):
         return self.obj.no_of_freelancers
@@ -552,6 +578,7 @@ class MasterProject(graphene.ObjectType):
         return self.obj.client_id
 
     def resolve_client(self, info, *args, **kwargs):
+        from clients.query import ClientMaster
         return ClientMaster.from_id(id=self.obj.client_id)
 
     def resolve_duration_count(self, info, *args, **kwargs):
@@ -575,12 +602,13 @@ class MasterProject(graphene.ObjectType):
     def resolve_candidate_counts(self, info, *args, **kwargs):
         session = get_session()
         stages = session.query(StageModel).filter_by(template_id=1).all()
+        stage_counts = get_candidate_stage_counts(session, self.obj.id)
         session.close()
         counts = [CandidateCount(
-            None, "All", len([c for c in self.obj.candidates if c.stage != "Remove from project"])
+            None, "All", sum(c for stage, c in stage_counts.items() if stage != "Remove from project")
         )]
         for stg in stages:
-            counts.append(CandidateCount(stg.id, stg.name, len([c for c in self.obj.candidates if c.stage == stg.name])))
+            counts.append(CandidateCount(stg.id, stg.name, stage_counts.get(stg.name, 0)))
         return counts
 
     def resolve_min_years_experience(self, info, *args, **kwargs):
@@ -621,17 +649,31 @@ class MasterProject(graphene.ObjectType):
         return [ScopeLink(f) for f in self.obj.scope_links]
 
     def resolve_members(self, info):
+        from admin.api import Admin
         return Admin.filtered_admins([f.member_id for f in self.obj.members])
 
     def resolve_note_list(self, info):
-        def created_at(note):
-            return note.created_at
-        return [ProjectNote(n) for n in sorted(self.obj.note_list, key=created_at, reverse=True)]
+        session = get_session()
+        notes, _ = get_note_rows(session, self.obj.id)
+        session.close()
+        return [ProjectNote(n) for n in notes]
+
+    def resolve_note_feed(self, info, first=10, after=None):
+        session = get_session()
+        notes, has_more = get_note_rows(session, self.obj.id, first=max(min(first, 100), 0), after=after)
+        session.close()
+        return ProjectNoteConnection(
+            notes=[ProjectNote(n) for n in notes],
+            next_cursor=encode_note_cursor(notes[-1]) if notes and has_more else None,
+            has_more=has_more
+        )
 
     def resolve_directors(self, info):
+        from admin.api import Admin
         return Admin.filtered_admins([f.director_id for f in self.obj.directors])
 
     def resolve_stakeholders(self, info):
+        from clients.query import POC
         return POC.from_ids(ids=[f.stakeholder_id for f in self.obj.stakeholders])
 
     def resolve_candidates(self, info, *args, **kwargs):
@@ -639,26 +681,13 @@ class MasterProject(graphene.ObjectType):
         end = kwargs.get('end', 9) + 1
         status = kwargs.get('status', "All")
         sort = kwargs.get('sort', None)
-        candidates = self.obj.candidates
-        if status != "All":
-            candidates = [c for c in candidates if c.stage == status]
-        candidates = [c for c in candidates if c.stage != "Remove from project"]
-        cids = [c.id for c in candidates]
-        session = get_session()
-        candidates = session.query(ProjectCandidateMapModel).options(joinedload('freelancer')).filter(ProjectCandidateMapModel.id.in_(cids)).all()
-        if sort:
-            reverse = sort.startswith("-")
-            sort = sort.replace("-", "")
-            if sort == "alphabetical":
-                candidates = sorted(candidates, key=lambda f: f.freelancer.name, reverse=reverse)
-            if sort == "created":
-                candidates = sorted(candidates, key=lambda f: f.freelancer.created_on, reverse=reverse)
-            if sort == "modified":
-                candidates = sorted(candidates, key=lambda f: f.freelancer.modified_at, reverse=reverse)
-            if sort == "added_to_project":
-                candidates = sorted(candidates, key=lambda f: f.added_on, reverse=reverse)
-
-        return [ProjectCandidate(c, self.obj.id) for c in candidates[start:end]]
+        session = get_session()
+        within_budget = kwargs.get('within_budget', False)
+        candidates = get_candidate_rows(
+            session, self.obj.id, status=status, sort=sort, start=start, end=end, within_budget=within_budget
+        )
+        session.close()
+        return [ProjectCandidate(c, self.obj.id) for c in candidates]
 
     def resolve_freelancer_location_type(self, info, *args, **kwargs):
         return self.obj.freelancer_location_type
@@ -681,6 +710,12 @@ class MasterProject(graphene.ObjectType):
     def resolve_is_client_confidential(self, info, *args, **kwargs):
         return self.obj.is_client_confidential
 
+    def resolve_assigned(self, info, *args, **kwargs):
+        return self.config.get('assigned', False)
+
+    def resolve_candidate_status(self, info, *args, **kwargs):
+        return self.config.get('candidate_status')
+
     @staticmethod
     def all(*args, **kwargs):
         from utils.index import search
@@ -688,29 +723,36 @@ class MasterProject(graphene.ObjectType):
         end = kwargs.get('end', 9) + 1
         session = get_session()
         if 'filter_stage' in kwargs:
-            projects = session.query(MasterProjectModel).filter_by(project_status=kwargs['filter_stage']).all()
+            query = for_stage(session.query(MasterProjectModel), kwargs['filter_stage'])
         else:
             # verify_admin(kwargs['token'])
             q = lower_plain_str(kwargs.get("q", ""))
             hits = search(q, "project", fields=['ac_search_field']).hits
             ids = [h.id for h in hits]
-            projects = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids)).all()
-            projects = sorted(projects, key=lambda p: p.created_at if p.created_at else datetime.datetime.min,
-                              reverse=True)
-        ans = [MasterProject(get_project_by_id(session, p.id)) for p in projects[start:end]]
+            query = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids))
+        projects, _ = page_project_rows(session, query, start, end)
         session.close()
-        return ans
+        return [MasterProject(p) for p in projects]
 
     @staticmethod
     def all_for_freelancer(*args, **kwargs):
         verify_admin(kwargs['token'])
         freelancer_id = kwargs['freelancer_id']
+        start = kwargs.get('start', 0)
+        end = kwargs.get('end', 9) + 1
+        q = kwargs.get('q', None)
         session = get_session()
-        project_ids = [c.project_id for c in get_candidates_for_freelancer(session, freelancer_id)]
-        print(project_ids)
-        projects = session.query(MasterProjectModel).all()
+        # the picker shows name, client and stage, anything else a query asks for loads per project
+        rows = get_projects_for_freelancer(session, freelancer_id, q=q, start=start, limit=max(end - start, 0))
         session.close()
-        return [MasterProject(p, p.id in project_ids) for p in projects]
+        page = ProjectPage([r.id for r in rows])
+        return [
+            MasterProject(
+                ProjectRow(r, PROJECT_SMALL_COLUMNS, page),
+                {'assigned': r.candidate_id is not None, 'candidate_status': r.stage}
+            )
+            for r in rows
+        ]
 
     @staticmethod
     def detail(*args, **kwargs):
@@ -733,47 +775,147 @@ class MasterProjectWithCount(graphene.ObjectType):
         start = kwargs.get('start', 0)
         end = kwargs.get('end', 9) + 1
 
-        if 'q' in kwargs and 'filter_stage' in kwargs:
+        query = None
+        if 'q' in kwargs:
             from utils.index import search
             q = lower_plain_str(kwargs.get("q", ""))
             hits = search(q, "project", fields=['ac_search_field']).hits
             ids = [h.id for h in hits]
-            projects = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids)) \
-                .filter_by(project_status=kwargs['filter_stage']).all()
-            projects = sorted(projects, key=lambda p: p.created_at if p.created_at else datetime.datetime.min,
-                              reverse=True)
+            query = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids))
+            if 'filter_stage' in kwargs:
+                query = for_stage(query, kwargs['filter_stage'])
         elif 'filter_stage' in kwargs:
-            if 'filter_stage' in kwargs and 'admin_id' in kwargs:
-                project_directors = session.query(ProjectDirectorsModel).filter_by(director_id=kwargs["admin_id"]).all()
-                project_directors_ids = [pd.project_id for pd in project_directors]
+            query = for_stage(session.query(MasterProjectModel), kwargs['filter_stage'])
+            if 'admin_id' in kwargs:
+                director_ids = session.query(ProjectDirectorsModel.project_id).filter_by(director_id=kwargs["admin_id"])
+                member_ids = session.query(ProjectTeamMemberModel.project_id).filter_by(member_id=kwargs["admin_id"])
+                query = query.filter(MasterProjectModel.id.in_(director_ids.union(member_ids)))
+
+        if query is None:
+            projects, count = [], 0
+        else:
+            projects, count = page_project_rows(session, query, start, end)
+        projects = [MasterProject(p) for p in projects]
 
-                project_team_members = session.query(ProjectTeamMemberModel).filter_by(member_id=kwargs["admin_id"]).all()
-                project_team_member_ids = [tm.project_id for tm in project_team_members]
+        session.close()
 
-                project_ids = list(set(project_directors_ids).union(set(project_team_member_ids)))
+        return MasterProjectWithCount(projects=projects, count=count)
+
+
+class FacetBucket(graphene.ObjectType):
+    key = graphene.String()
+    count = graphene.Int()
+
+
+class Facet(graphene.ObjectType):
+    name = graphene.String()
+    buckets = graphene.List(FacetBucket)
 
-                projects = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(project_ids)).filter_by(project_status=kwargs['filter_stage']).all()
-            else:
-                projects = session.query(MasterProjectModel).filter_by(project_status=kwargs['filter_stage']).all()
-            projects = sorted(projects, key=lambda p: p.created_at if p.created_at else datetime.datetime.min,
-                              reverse=True)
-        elif 'q' in kwargs:
-            from utils.index import search
-            q = lower_plain_str(kwargs.get("q", ""))
-            hits = search(q, "project", fields=['ac_search_field']).hits
-            ids = [h.id for h in hits]
-            projects = session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(ids)).all()
-            projects = sorted(projects, key=lambda p: p.created_at if p.created_at else datetime.datetime.min,
-                              reverse=True)
-        else:
-            projects = []
 
-        count = len(projects)
-        projects = [MasterProject(get_project_by_id(session, p.id)) for p in projects[start:end]]
+class ProjectFacetSearch(graphene.ObjectType):
+    projects = graphene.List(MasterProject)
+    count = graphene.Int()
+    facets = graphene.List(Facet)
 
+    @staticmethod
+    def all(*args, **kwargs):
+        from .facets import FACET_FIELDS, facet_search
+        verify_admin(kwargs['token'])
+        start = kwargs.get('start', 0)
+        end = kwargs.get('end', 9) + 1
+        q = lower_plain_str(kwargs.get("q", "")) or None
+        filters = {facet: kwargs[facet] for facet in FACET_FIELDS if kwargs.get(facet)}
+        res = facet_search(q, filters, start, end)
+        session = get_session()
+        projects = get_project_rows(session, res['ids'])
         session.close()
+        scores = dict(zip(res['ids'], res['scores']))
+        return ProjectFacetSearch(
+            projects=[MasterProject(p, score=scores.get(p.id, 0)) for p in projects],
+            count=res['count'],
+            facets=[
+                Facet(name=name, buckets=[FacetBucket(key=key, count=count) for key, count in buckets])
+                for name, buckets in res['facets'].items()
+            ]
+        )
+
+
+class CandidateSuggestion(graphene.ObjectType):
+    score = graphene.Float()
+    freelancer = graphene.Field('freelancer_profile.api.Freelancer')
 
-        return MasterProjectWithCount(projects=projects, count=count)
+    def __init__(self, freelancer_id, score, project_id=None):
+        self.freelancer_id = freelancer_id
+        self.score = score
+        self.project_id = project_id
+
+    def resolve_score(self, info):
+        return self.score
+
+    def resolve_freelancer(self, info):
+        from freelancer_profile.api import Freelancer, load_freelancer
+        session = get_session()
+        freelancer = load_freelancer(session, self.freelancer_id)
+        session.close()
+        return Freelancer(freelancer, project_id=self.project_id, show_full=True)
+
+    @staticmethod
+    def for_project(*args, **kwargs):
+        from .matching import get_engine
+        verify_admin(kwargs['token'])
+        project_id = kwargs['project_id']
+        session = get_session()
+        assigned = get_assigned_freelancer_ids(session, project_id)
+        session.close()
+        matches = get_engine().candidates_for_project(project_id, k=kwargs.get('k', 50), exclude=assigned)
+        return [CandidateSuggestion(freelancer_id, score, project_id) for freelancer_id, score in matches]
+
+
+class ProjectSuggestion(graphene.ObjectType):
+    score = graphene.Float()
+    project = graphene.Field(ProjectSmall)
+
+    @staticmethod
+    def for_freelancer(*args, **kwargs):
+        from .matching import get_engine
+        verify_admin(kwargs['token'])
+        freelancer_id = kwargs['freelancer_id']
+        session = get_session()
+        assigned = [c.project_id for c in get_candidate_rows_for_freelancer(session, freelancer_id)]
+        matches = get_engine().projects_for_freelancer(freelancer_id, k=kwargs.get('k', 20), exclude=assigned)
+        projects = get_project_rows(session, [project_id for project_id, _ in matches], PROJECT_SMALL_COLUMNS)
+        session.close()
+        scores = dict(matches)
+        return [ProjectSuggestion(project=ProjectSmall(p), score=scores[p.id]) for p in projects]
+
+
+class SimilarProject(graphene.ObjectType):
+    similarity = graphene.Float()
+    project = graphene.Field(ProjectSmall)
+
+    @staticmethod
+    def similar_projects(*args, **kwargs):
+        from .similarity import similar_projects
+        verify_admin(kwargs['token'])
+        matches = similar_projects(kwargs['id'], kwargs.get('k', 10))
+        session = get_session()
+        projects = get_project_rows(session, [project_id for project_id, _ in matches], PROJECT_SMALL_COLUMNS)
+        session.close()
+        scores = dict(matches)
+        return [SimilarProject(project=ProjectSmall(p), similarity=scores[p.id]) for p in projects]
+
+
+class ProjectSynonyms(graphene.ObjectType):
+    synonyms = graphene.List(graphene.String)
+
+    @staticmethod
+    def all(*args, **kwargs):
+        from .synonyms import get_synonyms
+        verify_admin(kwargs['token'])
+        session = get_session()
+        synonyms = get_synonyms(session)
+        session.close()
+        return ProjectSynonyms(synonyms=synonyms)
 
 
 class ResourcingConstants(graphene.ObjectType):
@@ -806,33 +948,29 @@ class ResourcingConstants(graphene.ObjectType):
 
 
 class ProjectFeedback(graphene.ObjectType):
-    scales = graphene.List(Scale)
-    criterias = graphene.List(ScaleCritera)
+    scales = graphene.List('scales.api.Scale')
+    criterias = graphene.List('scales.api.ScaleCritera')
 
     def resolve_scales(self, info):
-        session = get_session()
-        required_scales = get_project_scales(session, self.project_id)
-        for i in range(len(self.scales)):
-            self.scales[i].obj.required = self.scales[i].obj.id in required_scales
-        session.close()
-        return self.scales
+        from scales.api import Scale
+        return [Scale(s) for s in self.scales]
 
     def resolve_criterias(self, info):
-        session = get_session()
-        required_criterias = get_project_criterias(session, self.project_id)
-        for i in range(len(self.criterias)):
-            self.criterias[i].obj.required = self.criterias[i].obj.id in required_criterias
-        session.close()
-        return self.criterias
+        from scales.api import ScaleCritera
+        return [ScaleCritera(c) for c in self.criterias]
 
-    def __init__(self, project_id, token):
+    def __init__(self, project_id, scales, criterias):
         self.project_id = project_id
-        self.scales = Scale.all(token=token)
-        self.criterias = ScaleCritera.all_scale_criterias(token=token)
+        self.scales = scales
+        self.criterias = criterias
 
     @staticmethod
     def detail(*args, **kwargs):
-        return ProjectFeedback(kwargs['project_id'], kwargs['token'])
+        verify_admin(kwargs['token'])
+        session = get_session()
+        scales, criterias = get_feedback_form(session, kwargs['project_id'], kwargs['token'])
+        session.close()
+        return ProjectFeedback(kwargs['project_id'], scales, criterias)
 
 
 class AdminDashboardCounts(graphene.ObjectType):
@@ -846,13 +984,10 @@ class AdminDashboardCounts(graphene.ObjectType):
 
         pending_qa = session.query(FreelancerModel).filter_by(interview_status="Pending").all()
         total_freelancers = session.query(FreelancerModel).all()
-        live_projects = session.query(MasterProjectModel)\
-            .filter(MasterProjectModel.project_status != "Won")\
-            .filter(MasterProjectModel.project_status != "Lost").all()
 
         pending_qa_count = len(pending_qa)
         total_freelancers_count = len(total_freelancers)
-        live_projects_count = len(live_projects)
+        live_projects_count = count_live_projects(session)
 
         session.close()
 
@@ -0,0 +1,165 @@
+import time
+import threading
+from sqlalchemy import event, select, case, func
+from utils.exceptions import InvalidRequest
+from .models import MasterProjectModel, ProjectCandidateMapModel, CurrencyRateModel
+from .migrations import skip_modified_touch
+
+
+BASE_CURRENCY = "INR"
+# same fallback ProjectCandidate.resolve_rate_currency uses for quotes without a currency
+DEFAULT_CURRENCY = "INR"
+FX_CACHE_SECONDS = 300
+
+# working days per unit, shared by budget units (singular) and duration units (plural)
+UNIT_DAYS = {
+    'hour': 1.0 / 8,
+    'day': 1.0,
+    'week': 5.0,
+    'month': 21.0,
+    'year': 252.0,
+}
+
+
+def unit_days(unit):
+    if not unit:
+        return None
+    unit = unit.strip().lower()
+    return UNIT_DAYS.get(unit[:-1] if unit.endswith('s') else unit)
+
+
+class FxCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rates = {}
+        self.loaded_at = 0.0
+
+    def get(self, connection):
+        with self.lock:
+            if time.monotonic() - self.loaded_at > FX_CACHE_SECONDS:
+                table = CurrencyRateModel.__table__
+                rows = connection.execute(select([table.c.currency, table.c.rate_to_base])).fetchall()
+                self.rates = {c.upper(): r for c, r in rows}
+                self.rates[BASE_CURRENCY] = 1.0
+                self.loaded_at = time.monotonic()
+            return self.rates
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = 0.0
+
+
+fx_cache = FxCache()
+
+
+def to_base(amount, currency, rates):
+    rate = rates.get((currency or DEFAULT_CURRENCY).upper())
+    if amount is None or rate is None:
+        return None
+    return amount * rate
+
+
+def daily_rate(amount, unit, currency, rates):
+    days = unit_days(unit)
+    value = to_base(amount, currency, rates)
+    if days is None or value is None:
+        return None
+    return value / days
+
+
+def project_daily_budget(project, rates):
+    if (project.budget_unit or "").strip().lower() == 'project':
+        days = unit_days(project.duration_unit)
+        if not days or not project.duration_count:
+            return None
+        value = to_base(project.budget_amount, project.budget_currency, rates)
+        return value / (days * project.duration_count) if value is not None else None
+    return daily_rate(project.budget_amount, project.budget_unit, project.budget_currency, rates)
+
+
+@event.listens_for(ProjectCandidateMapModel, 'before_insert')
+@event.listens_for(ProjectCandidateMapModel, 'before_update')
+def set_candidate_daily_rate(mapper, connection, target):
+    target.daily_rate_base = daily_rate(
+        target.rate_amount, target.rate_unit, target.rate_currency, fx_cache.get(connection)
+    )
+
+
+@event.listens_for(MasterProjectModel, 'before_insert')
+@event.listens_for(MasterProjectModel, 'before_update')
+def set_project_daily_budget(mapper, connection, target):
+    target.budget_daily_base = project_daily_budget(target, fx_cache.get(connection))
+
+
+def unit_days_sql(column):
+    unit = func.regexp_replace(func.lower(func.trim(column)), 's$', '')
+    return case([(unit == name, days) for name, days in UNIT_DAYS.items()], else_=None)
+
+
+def recompute_candidate_rates(session, currencies=None):
+    # normalised costs are not in the ES document, keep the recompute out of the delta reindex
+    skip_modified_touch(session)
+    table = CurrencyRateModel.__table__
+    currency = func.upper(func.coalesce(ProjectCandidateMapModel.rate_currency, DEFAULT_CURRENCY))
+    rate = select([table.c.rate_to_base]).where(table.c.currency == currency).as_scalar()
+    if_base = case([(currency == BASE_CURRENCY, 1.0)], else_=rate)
+    query = session.query(ProjectCandidateMapModel)
+    if currencies is not None:
+        query = query.filter(currency.in_([c.upper() for c in currencies]))
+    return query.update({
+        ProjectCandidateMapModel.daily_rate_base:
+            ProjectCandidateMapModel.rate_amount * if_base / unit_days_sql(ProjectCandidateMapModel.rate_unit)
+    }, synchronize_session=False)
+
+
+def recompute_project_budgets(session, currencies=None):
+    skip_modified_touch(session)
+    table = CurrencyRateModel.__table__
+    currency = func.upper(func.coalesce(MasterProjectModel.budget_currency, DEFAULT_CURRENCY))
+    rate = select([table.c.rate_to_base]).where(table.c.currency == currency).as_scalar()
+    if_base = case([(currency == BASE_CURRENCY, 1.0)], else_=rate)
+    per_project = func.lower(func.trim(MasterProjectModel.budget_unit)) == 'project'
+    days = case([
+        (per_project, unit_days_sql(MasterProjectModel.duration_unit) * MasterProjectModel.duration_count)
+    ], else_=unit_days_sql(MasterProjectModel.budget_unit))
+    query = session.query(MasterProjectModel)
+    if currencies is not None:
+        query = query.filter(currency.in_([c.upper() for c in currencies]))
+    return query.update({
+        MasterProjectModel.budget_daily_base: MasterProjectModel.budget_amount * if_base / func.nullif(days, 0)
+    }, synchronize_session=False)
+
+
+def set_fx_rates(session, rates):
+    # rates: {currency: units of BASE_CURRENCY per unit}, every stored cost in those currencies is recomputed in SQL
+    invalid = sorted(c for c, r in rates.items() if not c or r is None or r <= 0)
+    if invalid:
+        raise InvalidRequest("invalid fx rates for {}".format(invalid))
+    changed = []
+    for currency, rate in rates.items():
+        currency = currency.upper()
+        row = session.query(CurrencyRateModel).filter_by(currency=currency).scalar()
+        if row is None:
+            session.add(CurrencyRateModel(currency=currency, rate_to_base=rate))
+        elif row.rate_to_base != rate:
+            row.rate_to_base = rate
+        else:
+            continue
+        changed.append(currency)
+    session.flush()
+    if changed:
+        recompute_candidate_rates(session, changed)
+        recompute_project_budgets(session, changed)
+    fx_cache.invalidate()
+    return changed
+
+
+if __name__ == "__main__":
+    # python -m <package>.rates USD=83.2 EUR=90.1
+    import sys
+    from utils.db import get_session
+    session = get_session()
+    changed = set_fx_rates(session, {c: float(r) for c, _, r in (a.partition("=") for a in sys.argv[1:])})
+    session.commit()
+    session.close()
+    print("fx rates changed for {}".format(changed))
@@ -0,0 +1,97 @@
+import atexit
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+PENDING_KEY = 'pending_freelancer_reindex'
+FREELANCER_INDEX = 'freelancer'
+
+
+def queue_freelancer_reindex(session, *freelancer_ids):
+    # reindexing happens once per freelancer after the session commits
+    pending = session.info.setdefault(PENDING_KEY, set())
+    pending.update(f for f in freelancer_ids if f)
+
+
+def reindex_freelancers(freelancer_ids):
+    # one query and one bulk request for the whole batch instead of insert_freelancer per id
+    from elasticsearch import helpers
+    from utils.db import get_session
+    from utils.es_conn import es
+    from utils.index import get_freelancer_json
+    from freelancer_auth.models import FreelancerModel
+    session = get_session()
+    try:
+        freelancers = session.query(FreelancerModel).filter(FreelancerModel.id.in_(sorted(freelancer_ids))).all()
+        bodies = []
+        for freelancer in freelancers:
+            doc = get_freelancer_json(session, freelancer)
+            doc.update({
+                '_index': FREELANCER_INDEX,
+                '_type': FREELANCER_INDEX,
+                '_id': freelancer.id
+            })
+            bodies.append(doc)
+        _, errors = helpers.bulk(es, bodies, chunk_size=1000, request_timeout=200, raise_on_error=False)
+    except Exception as e:
+        print("failed to re index {}".format(sorted(freelancer_ids)), e)
+        return
+    finally:
+        session.close()
+    for error in errors:
+        print("failed to re index", error)
+
+
+class ReindexWorker(object):
+    def __init__(self, reindex=reindex_freelancers):
+        self.reindex = reindex
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, freelancer_ids):
+        with self.lock:
+            self.pending.update(freelancer_ids)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="freelancer-reindex", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                ids, self.pending = self.pending, set()
+                if not ids:
+                    self.thread = None
+                    return
+            self.reindex(ids)
+
+    def drain(self):
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+        with self.lock:
+            ids, self.pending = self.pending, set()
+        if ids:
+            self.reindex(ids)
+
+
+worker = ReindexWorker()
+
+
+@atexit.register
+def flush_reindex():
+    # the worker thread is a daemon, ids still queued when the process exits are indexed here
+    worker.drain()
+
+
+@event.listens_for(Session, 'after_commit')
+def submit_pending_reindex(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        worker.submit(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_reindex(session):
+    session.info.pop(PENDING_KEY, None)
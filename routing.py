@@ -0,0 +1,182 @@
+import os
+import time
+import threading
+import contextlib
+import contextvars
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from utils.db import get_session as get_primary_session
+from .pool_monitor import TimedQueuePool
+
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+# operation name -> target, anything not listed falls back to the operation type default
+OPERATION_ROUTES = {}
+DEFAULT_ROUTES = {
+    'query': REPLICA,
+    'mutation': PRIMARY,
+}
+
+MAX_REPLICA_LAG_SECONDS = float(os.environ.get("PROJECT_DB_MAX_REPLICA_LAG", 5))
+LAG_CHECK_INTERVAL_SECONDS = 2
+# after a write the client keeps reading from the primary for this long so it sees its own changes
+STICKY_PRIMARY_SECONDS = float(os.environ.get("PROJECT_DB_STICKY_PRIMARY", 5))
+# cookie the view hands back after a write, holding the epoch time until which reads stay on the primary
+STICKY_COOKIE = 'project_db_primary_until'
+
+current_route = contextvars.ContextVar('project_db_route', default=PRIMARY)
+# {'sticky_until': epoch seconds} shared by every field of one request, including the ones run in
+# async_execution.py worker threads, they get a copy of the context but the same dict
+routing_state = contextvars.ContextVar('project_db_routing_state', default=None)
+
+
+class ReplicaRouter(object):
+    def __init__(self, primary=None, replica_url=None, max_lag=MAX_REPLICA_LAG_SECONDS, **engine_kwargs):
+        self.primary = primary or get_primary_session
+        self.replica = None
+        if replica_url:
+            engine_kwargs.setdefault('poolclass', TimedQueuePool)
+            self.replica = sessionmaker(bind=create_engine(replica_url, **engine_kwargs))
+        self.max_lag = max_lag
+        self.lock = threading.Lock()
+        self.lag = None
+        self.lag_checked_at = 0.0
+
+    def replica_lag(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.lag_checked_at < LAG_CHECK_INTERVAL_SECONDS:
+                return self.lag
+            self.lag_checked_at = now
+        session = self.replica()
+        try:
+            # the last replay timestamp keeps aging on an idle primary, a replica that has replayed
+            # everything it received is caught up whatever that timestamp says
+            lag = session.execute(text(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )).scalar()
+            lag = float(lag)
+        except Exception as e:
+            print("replica lag check failed", e)
+            lag = None
+        finally:
+            session.close()
+        with self.lock:
+            self.lag = lag
+        return lag
+
+    def replica_usable(self):
+        if self.replica is None:
+            return False
+        lag = self.replica_lag()
+        return lag is not None and lag <= self.max_lag
+
+    def get_session(self, route=None):
+        route = route or current_route.get()
+        if route == REPLICA and time.time() >= sticky_deadline() and self.replica_usable():
+            return self.replica()
+        return self.primary()
+
+
+router = ReplicaRouter(replica_url=os.environ.get("PROJECT_DB_REPLICA_URL"))
+
+
+def configure(primary_url=None, replica_url=None, **kwargs):
+    global router
+    primary = sessionmaker(bind=create_engine(primary_url, poolclass=TimedQueuePool)) if primary_url else None
+    router = ReplicaRouter(primary=primary, replica_url=replica_url, **kwargs)
+    return router
+
+
+def get_session():
+    return router.get_session()
+
+
+def get_write_session():
+    return router.get_session(PRIMARY)
+
+
+def sticky_deadline():
+    state = routing_state.get()
+    return state['sticky_until'] if state else 0.0
+
+
+def parse_sticky(value):
+    # the client sends back what STICKY_COOKIE was set to, never trust more than one sticky period
+    try:
+        return min(float(value), time.time() + STICKY_PRIMARY_SECONDS)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@contextlib.contextmanager
+def request_routing(sticky=None):
+    # wraps one HTTP request, sticky is the STICKY_COOKIE value the client sent:
+    #   with request_routing(request.cookies.get(STICKY_COOKIE)) as state:
+    #       result = execute(schema, query)
+    #   if state['written']:
+    #       response.set_cookie(STICKY_COOKIE, str(state['sticky_until']), max_age=STICKY_PRIMARY_SECONDS)
+    state = {'sticky_until': parse_sticky(sticky), 'written': False}
+    token = routing_state.set(state)
+    try:
+        yield state
+    finally:
+        routing_state.reset(token)
+
+
+@contextlib.contextmanager
+def stick_to_primary():
+    state = routing_state.get()
+    token = None
+    if state is None:
+        # outside request_routing the stickiness only lasts for the block
+        state = {'sticky_until': 0.0, 'written': False}
+        token = routing_state.set(state)
+    state['sticky_until'] = max(state['sticky_until'], time.time() + STICKY_PRIMARY_SECONDS)
+    state['written'] = True
+    try:
+        yield
+    finally:
+        if token is not None:
+            routing_state.reset(token)
+
+
+@contextlib.contextmanager
+def use_route(route):
+    token = current_route.set(route)
+    try:
+        yield
+    finally:
+        current_route.reset(token)
+
+
+def route_for_operation(operation_type, operation_name=None):
+    if operation_name and operation_name in OPERATION_ROUTES:
+        return OPERATION_ROUTES[operation_name]
+    return DEFAULT_ROUTES.get(operation_type, PRIMARY)
+
+
+def with_routing(middleware=None):
+    # last in the list is outermost in graphql-core, the route is set before ThreadedResolverMiddleware
+    # copies the context into a worker thread
+    middleware = list(middleware or [])
+    if not any(isinstance(m, SessionRoutingMiddleware) for m in middleware):
+        middleware.append(SessionRoutingMiddleware())
+    return middleware
+
+
+class SessionRoutingMiddleware(object):
+    # set around every field and reset after it, nested fields can run in another thread's copy of
+    # the context (async_execution.py) and nothing may leak into the next request on this thread
+    def resolve(self, next, root, info, **args):
+        operation = info.operation
+        name = operation.name.value if operation.name else None
+        with use_route(route_for_operation(operation.operation, name)):
+            if operation.operation != 'mutation':
+                return next(root, info, **args)
+            # a mutation reads back what it wrote, and so does the client's next request, see request_routing
+            with stick_to_primary():
+                return next(root, info, **args)
@@ -0,0 +1,266 @@
+import base64
+import datetime
+import threading
+from collections import defaultdict
+from sqlalchemy import or_, func, tuple_
+from auth.models import UserModel
+from utils.exceptions import InvalidRequest
+from freelancer_auth.models import FreelancerModel
+from .models import (
+    MasterProjectModel, ProjectCandidateMapModel, MasterProjectAttributeMap, ProjectNoteModel, ProjectTeamMemberModel,
+    ProjectDirectorsModel, ProjectStakeholdersModel, ProjectScopeFileModel, ProjectScopeLinkModel
+)
+
+
+# text columns that list views never show, fetched only when a field actually needs them
+DEFERRED_PROJECT_COLUMNS = ('background', 'notes', 'budget_notes', 'educational_background')
+PROJECT_LIST_COLUMNS = tuple(
+    c.name for c in MasterProjectModel.__table__.columns if c.name not in DEFERRED_PROJECT_COLUMNS
+)
+PROJECT_SMALL_COLUMNS = ('id', 'name', 'client_id', 'project_status', 'created_at')
+
+# relationships the MasterProject resolvers read, loaded for a whole page of rows in one query each
+PROJECT_CHILDREN = {
+    'members': ProjectTeamMemberModel,
+    'directors': ProjectDirectorsModel,
+    'stakeholders': ProjectStakeholdersModel,
+    'scope_files': ProjectScopeFileModel,
+    'scope_links': ProjectScopeLinkModel,
+}
+
+CANDIDATE_COLUMNS = (
+    'id', 'project_id', 'freelancer_id', 'rejected', 'added_on', 'stage', 'rate_unit', 'rate_currency', 'rate_amount'
+)
+
+CANDIDATE_SORTS = {
+    "alphabetical": FreelancerModel.name,
+    "created": FreelancerModel.created_on,
+    "modified": FreelancerModel.modified_at,
+    "added_to_project": ProjectCandidateMapModel.added_on,
+    "rate": ProjectCandidateMapModel.daily_rate_base,
+}
+
+
+class ProjectPage(object):
+    # shared by the rows of one page, the first row to need a relationship or deferred column loads it for all
+    def __init__(self, ids):
+        self.ids = ids
+        self.lock = threading.Lock()
+        self.loaded = {}
+
+    def covers(self, name):
+        return name in PROJECT_CHILDREN or name in DEFERRED_PROJECT_COLUMNS
+
+    def get(self, name, project_id):
+        key = name if name in PROJECT_CHILDREN else DEFERRED_PROJECT_COLUMNS
+        with self.lock:
+            if key not in self.loaded:
+                self.loaded[key] = self.load(key)
+        if key is DEFERRED_PROJECT_COLUMNS:
+            row = self.loaded[key].get(project_id)
+            return getattr(row, name) if row else None
+        return self.loaded[key].get(project_id, [])
+
+    def load(self, key):
+        from .routing import get_session
+        session = get_session()
+        if key is DEFERRED_PROJECT_COLUMNS:
+            loaded = {r.id: r for r in session.query(*project_columns(('id',) + DEFERRED_PROJECT_COLUMNS)).filter(
+                MasterProjectModel.id.in_(self.ids)
+            )}
+        else:
+            model = PROJECT_CHILDREN[key]
+            loaded = defaultdict(list)
+            for obj in session.query(model).filter(model.project_id.in_(self.ids)).order_by(model.id):
+                loaded[obj.project_id].append(obj)
+        # the children only carry columns, they stay readable once the session lets go of them
+        session.close()
+        return loaded
+
+
+class ProjectRow(object):
+    __slots__ = tuple(c.name for c in MasterProjectModel.__table__.columns) + ('_full', '_page')
+
+    def __init__(self, row, columns, page=None):
+        for name in columns:
+            setattr(self, name, getattr(row, name))
+        self._page = page
+
+    def __getattr__(self, name):
+        # only reached for columns that were not projected or for relationships
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._page is not None and self._page.covers(name):
+            return self._page.get(name, self.id)
+        return getattr(self.load_full(), name)
+
+    def load_full(self):
+        try:
+            return self._full
+        except AttributeError:
+            from .routing import get_session
+            from .services import get_project_by_id
+            session = get_session()
+            self._full = get_project_by_id(session, self.id)
+            session.close()
+            return self._full
+
+    def get_attributes(self, session, map_name):
+        return get_project_attributes(session, self.id, map_name)
+
+
+class CandidateRow(object):
+    __slots__ = CANDIDATE_COLUMNS
+
+    def __init__(self, row):
+        for name in CANDIDATE_COLUMNS:
+            setattr(self, name, getattr(row, name))
+
+
+class NoteRow(object):
+    __slots__ = ('id', 'note', 'project_id', 'admin_id', 'created_at', 'author_email')
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+
+def project_columns(columns):
+    return [getattr(MasterProjectModel, c) for c in columns]
+
+
+def get_project_attributes(session, project_id, map_name):
+    table = MasterProjectAttributeMap.MAP[map_name]
+    return session.query(table).join(
+        MasterProjectAttributeMap, MasterProjectAttributeMap.map_id == table.id
+    ).filter(
+        MasterProjectAttributeMap.project_id == project_id, MasterProjectAttributeMap.map_name == map_name
+    ).all()
+
+
+def get_project_rows(session, ids, columns=PROJECT_LIST_COLUMNS):
+    if not ids:
+        return []
+    rows = session.query(*project_columns(columns)).filter(MasterProjectModel.id.in_(ids)).all()
+    page = ProjectPage([r.id for r in rows])
+    by_id = {r.id: ProjectRow(r, columns, page) for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def project_page_query(query, start, end, columns=PROJECT_LIST_COLUMNS):
+    # same order as ix_master_projects_status_created_desc and its live partial twin
+    return query.with_entities(*project_columns(columns)).order_by(
+        MasterProjectModel.created_at.desc().nullslast(), MasterProjectModel.id.desc()
+    ).offset(start).limit(max(end - start, 0))
+
+
+def page_project_rows(session, query, start, end, columns=PROJECT_LIST_COLUMNS):
+    count = query.count()
+    rows = project_page_query(query, start, end, columns).all()
+    page = ProjectPage([r.id for r in rows])
+    return [ProjectRow(r, columns, page) for r in rows], count
+
+
+def get_candidate_rows(session, project_id, status="All", sort=None, start=0, end=None, within_budget=False):
+    query = session.query(*[getattr(ProjectCandidateMapModel, c) for c in CANDIDATE_COLUMNS]).filter(
+        ProjectCandidateMapModel.project_id == project_id,
+        or_(ProjectCandidateMapModel.stage.is_(None), ProjectCandidateMapModel.stage != "Remove from project")
+    )
+    if status != "All":
+        query = query.filter(ProjectCandidateMapModel.stage == status)
+    if within_budget:
+        budget = session.query(MasterProjectModel.budget_daily_base).filter(
+            MasterProjectModel.id == project_id
+        ).as_scalar()
+        query = query.filter(ProjectCandidateMapModel.daily_rate_base <= budget)
+    order = [ProjectCandidateMapModel.id]
+    if sort:
+        reverse = sort.startswith("-")
+        column = CANDIDATE_SORTS.get(sort.replace("-", ""))
+        if column is not None:
+            if column.class_ is FreelancerModel:
+                query = query.join(FreelancerModel, FreelancerModel.id == ProjectCandidateMapModel.freelancer_id)
+            order = [(column.desc() if reverse else column.asc()).nullslast(), ProjectCandidateMapModel.id]
+    query = query.order_by(*order).offset(start)
+    if end is not None:
+        query = query.limit(max(end - start, 0))
+    return [CandidateRow(r) for r in query.all()]
+
+
+def get_candidate_rows_for_freelancer(session, freelancer_id):
+    rows = session.query(*[getattr(ProjectCandidateMapModel, c) for c in CANDIDATE_COLUMNS]).filter(
+        ProjectCandidateMapModel.freelancer_id == freelancer_id
+    ).all()
+    return [CandidateRow(r) for r in rows]
+
+
+def get_assigned_freelancer_ids(session, project_id):
+    # every freelancer ever mapped to the project, removed candidates included
+    return [fid for fid, in session.query(ProjectCandidateMapModel.freelancer_id).filter(
+        ProjectCandidateMapModel.project_id == project_id
+    )]
+
+
+def get_candidate_stage_counts(session, project_id):
+    return dict(session.query(ProjectCandidateMapModel.stage, func.count(ProjectCandidateMapModel.id)).filter(
+        ProjectCandidateMapModel.project_id == project_id
+    ).group_by(ProjectCandidateMapModel.stage).all())
+
+
+def encode_note_cursor(note):
+    created_at = note.created_at.isoformat() if note.created_at else ""
+    return base64.urlsafe_b64encode("{}|{}".format(created_at, note.id).encode()).decode()
+
+
+def decode_note_cursor(cursor):
+    try:
+        created_at, note_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return (datetime.datetime.fromisoformat(created_at) if created_at else None), int(note_id)
+    except ValueError:
+        raise InvalidRequest("invalid cursor")
+
+
+def note_rows_query(session, project_id):
+    return session.query(
+        ProjectNoteModel.id, ProjectNoteModel.note, ProjectNoteModel.project_id, ProjectNoteModel.admin_id,
+        ProjectNoteModel.created_at, UserModel.email.label('author_email')
+    ).outerjoin(UserModel, UserModel.id == ProjectNoteModel.admin_id).filter(
+        ProjectNoteModel.project_id == project_id
+    ).order_by(ProjectNoteModel.created_at.desc().nullslast(), ProjectNoteModel.id.desc())
+
+
+def dated_notes_after(query, created_at, note_id):
+    # row comparison, matches ix_project_notes_project_created_desc so postgres seeks straight to the cursor
+    return query.filter(tuple_(ProjectNoteModel.created_at, ProjectNoteModel.id) < tuple_(created_at, note_id))
+
+
+def undated_notes_after(query, note_id=None):
+    query = query.filter(ProjectNoteModel.created_at.is_(None))
+    if note_id is not None:
+        query = query.filter(ProjectNoteModel.id < note_id)
+    return query
+
+
+def get_note_rows(session, project_id, first=None, after=None):
+    query = note_rows_query(session, project_id)
+    limit = None if first is None else first + 1
+    if after:
+        created_at, note_id = decode_note_cursor(after)
+        if created_at is None:
+            # notes without a timestamp sort last, so only older-id nulls remain
+            pages = [undated_notes_after(query, note_id)]
+        else:
+            # the row comparison never matches an undated note, those follow every dated one
+            pages = [dated_notes_after(query, created_at, note_id), undated_notes_after(query)]
+    else:
+        pages = [query]
+    rows = []
+    for page in pages:
+        if limit is not None:
+            if len(rows) >= limit:
+                break
+            page = page.limit(limit - len(rows))
+        rows.extend(NoteRow(r) for r in page.all())
+    if first is not None and len(rows) > first:
+        return rows[:first], True
+    return rows, False
@@ -1,35 +1,43 @@
 import re
 import json
+import hashlib
 from utils.db import get_session
 from utils.es_conn import es
 from utils.string_utils import lower_plain_str
 from elasticsearch import helpers
 from clients.models import ClientMasterModel
 from auth.models import UserModel
-from .models import MasterProjectModel, ProjectDirectorsModel, ProjectTeamMemberModel, ProjectCandidateMapModel
-
-
-SYNONYM_ANALYSER = {
-    "analysis": {
-        "analyzer": {
-            "default": {
-                "tokenizer": "whitespace",
-                "filter": ["synonym", "lowercase"]
-            }
-        },
-        "filter": {
-            "synonym": {
-                "type": "synonym",
-                "synonyms": ["oil,petrol"],
-                "ignore_case": True
-            }
-        }
-    }
-}
-
-
-def get_project_json(session, project):
-    print(project.city, project.country)
+from .synonyms import get_synonyms, create_versioned_index, swap_alias, catch_up
+from .models import (
+    MasterProjectModel, ProjectDirectorsModel, ProjectTeamMemberModel, ProjectCandidateMapModel, MasterProjectAttributeMap
+)
+
+
+RELATION_BATCH_SIZE = 500
+
+
+def load_project_relations(session, project_ids):
+    # four queries for any number of projects, the doc builders take one entry each
+    relations = {pid: {"skills": [], "sectors": [], "directors": [], "members": []} for pid in project_ids}
+    if not project_ids:
+        return relations
+    for map_name, key in (("expertise", "skills"), ("sector", "sectors")):
+        table = MasterProjectAttributeMap.MAP[map_name]
+        rows = session.query(MasterProjectAttributeMap.project_id, table.name).join(
+            table, table.id == MasterProjectAttributeMap.map_id
+        ).filter(MasterProjectAttributeMap.project_id.in_(project_ids), MasterProjectAttributeMap.map_name == map_name)
+        for project_id, name in rows:
+            relations[project_id][key].append(name)
+    for column, key in ((ProjectDirectorsModel.director_id, "directors"), (ProjectTeamMemberModel.member_id, "members")):
+        model = column.class_
+        for project_id, value in session.query(model.project_id, column).filter(model.project_id.in_(project_ids)):
+            relations[project_id][key].append(value)
+    return relations
+
+
+def get_project_json(session, project, relations=None):
+    if relations is None:
+        relations = load_project_relations(session, [project.id])[project.id]
 
     data = {
         "project_title": project.name,
@@ -42,21 +50,24 @@ def get_project_json(session, project):
         "country": project.country,
         "client_type": project.client_type,
         "closed_quarter": project.closed_quarter,
+        "closed_year": project.closed_year,
         "duration": "{} {}".format(project.duration_count, project.duration_unit),
         "budget": "{} {} {}".format(project.budget_amount, project.budget_currency, project.budget_unit),
         "client_name": project.client_id,
-        "skills": [s.name for s in project.get_attributes(session, "expertise")],
-        "sectors": [s.name for s in project.get_attributes(session, "sector")],
+        "skills": relations["skills"],
+        "sectors": relations["sectors"],
         "freelancer_location_type": project.freelancer_location_type,
         "educational_background": project.educational_background,
         "segment": project.segment,
         "sub_segment": project.sub_segment,
         "is_client_confidential": project.is_client_confidential
     }
+    if project.created_at:
+        data["created_at"] = project.created_at.isoformat()
     if project.project_start_date:
         data["project_start_date"] = str(project.project_start_date)
-    data["directors"] = [m.director_id for m in session.query(ProjectDirectorsModel).filter_by(project_id=project.id).all()]
-    data["members"] = [m.member_id for m in session.query(ProjectTeamMemberModel).filter_by(project_id=project.id).all()]
+    data["directors"] = relations["directors"]
+    data["members"] = relations["members"]
     return data
 
 
@@ -91,50 +102,90 @@ def val_to_str(v):
     return remove_trailing_special(str(v))
 
 
+def project_fingerprint(doc):
+    # list order comes from unordered queries and means nothing to search, full_text is derived from the rest
+    canonical = {k: sorted(str(i) for i in v) if isinstance(v, list) else v for k, v in doc.items() if k != "full_text"}
+    body = json.dumps(canonical, sort_keys=True, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def build_project_doc(session, project, clients, users, relations=None):
+    doc = get_project_json(session, project, relations)
+    doc["client_name"] = clients.get(doc['client_name'], "")
+    if doc["client_name"]:
+        doc["project_title"] = "{} - {}".format(doc["client_name"], doc["project_title"])
+    doc["ac_search_field"] = lower_plain_str(doc['project_title'])
+    doc["directors"] = [users.get(d, "") for d in doc['directors']]
+    doc["members"] = [users.get(d, "") for d in doc['members']]
+    doc["full_text"] = " ".join([val_to_str(v) for v in doc.values()])
+    doc["fingerprint"] = project_fingerprint(doc)
+    return doc
+
+
+def get_indexed_fingerprints(ids):
+    if not ids:
+        return {}
+    res = es.mget(index='project', doc_type='project', body={'ids': ids}, _source=['fingerprint'])
+    return {int(d['_id']): d['_source'].get('fingerprint') for d in res['docs'] if d.get('found')}
+
+
+def project_keyword_doc(doc):
+    return {
+        "keyword": doc["project_title"],
+        "keyword_type": "project",
+        "keyword_id": doc["id"],
+        "ac_search_field": lower_plain_str(doc["project_title"])
+    }
+
+
+def iter_with_relations(session, projects, batch_size=RELATION_BATCH_SIZE):
+    for i in range(0, len(projects), batch_size):
+        batch = projects[i:i + batch_size]
+        relations = load_project_relations(session, [p.id for p in batch])
+        for project in batch:
+            yield project, relations[project.id]
+
+
 def index_all_projects(projects=None, keep_index=False):
     from utils.index import push_doc
+    from .delta_index import db_now
 
     session = get_session()
-    if es.indices.exists('project') and not keep_index:
-        es.indices.delete('project')
-        settings = {
-            "settings": SYNONYM_ANALYSER
-        }
-        es.indices.create('project', body=settings)
+    target = 'project'
+    if not keep_index:
+        started_at = db_now(session)
+        target = create_versioned_index(get_synonyms(session))
 
     bodies = []
     clients = {c.id: c.name for c in session.query(ClientMasterModel).all()}
     users = {u.id: u.name for u in session.query(UserModel).all()}
     if not projects:
         projects = session.query(MasterProjectModel).all()
-    for project in projects:
-        doc = get_project_json(session, project)
-        doc["client_name"] = clients.get(doc['client_name'], "")
-        if doc["client_name"]:
-            doc["project_title"] = "{} - {}".format(doc["client_name"], doc["project_title"])
-        doc["ac_search_field"] = lower_plain_str(doc['project_title'])
-        doc["directors"] = [users.get(d, "") for d in doc['directors']]
-        doc["members"] = [users.get(d, "") for d in doc['members']]
-        doc["full_text"] = " ".join([val_to_str(v) for v in doc.values()])
+    # into an existing index, docs whose content has not changed are not written again
+    indexed = get_indexed_fingerprints([p.id for p in projects]) if keep_index else {}
+    skipped = 0
+    for project, relations in iter_with_relations(session, projects):
+        doc = build_project_doc(session, project, clients, users, relations)
+        # an unchanged doc has an unchanged title, its keyword doc is left alone too. consistency.py checks both
+        if indexed.get(project.id) == doc["fingerprint"]:
+            skipped += 1
+            continue
+        kdoc = project_keyword_doc(doc)
         doc.update({
-            '_index': 'project',
+            '_index': target,
             '_type': 'project',
             '_id': project.id
         })
         bodies.append(doc)
 
-        kdoc = {
-            "keyword": doc["project_title"],
-            "keyword_type": "project",
-            "keyword_id": project.id,
-            "ac_search_field": lower_plain_str(doc["project_title"])
-        }
-
         kdoc_id = "project_{}".format(project.id)
 
         push_doc(kdoc, kdoc_id, "keyword", "keyword")
 
     res = helpers.bulk(es, bodies, chunk_size=1000, request_timeout=200)
-    print(res)
+    print(res, "unchanged:", skipped)
+    if not keep_index:
+        swap_alias(target)
+        catch_up(session, started_at)
     session.commit()
     session.close()
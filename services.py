@@ -1,10 +1,17 @@
+from sqlalchemy import and_
 from sqlalchemy.orm import joinedload
-from utils.ses import send_project_resourcing_email
+from sqlalchemy.dialects.postgresql import insert
 import datetime
 from utils.exceptions import InvalidRequest
 from freelancer_auth.models import FreelancerNoteModel, FreelancerModel
 from auth.models import UserModel
+from process.models import StageModel
+from clients.models import ClientMasterModel
 import os
+from . import rates  # noqa: F401, registers the cost normalisation listeners
+from . import archive  # noqa: F401, keeps master_projects.archived in sync with the stage
+from .reindex import queue_freelancer_reindex
+from .rows import PROJECT_SMALL_COLUMNS, project_columns
 from .models import (
     MasterProjectModel, ProjectLocationModel, ProjectResourcingModel, ProjectTeamMemberModel, ProjectScopeLinkModel, ProjectScopeFileModel,
     ProjectClientModel, ProjectCandidateMapModel, ProjectScaleMapModel, ProjectCriteriaMapModel, ProjectStakeholdersModel, ProjectDirectorsModel,
@@ -67,6 +74,7 @@ def add_projection_location_details(session, *args, **kwargs):
 
 
 def add_project_resourcing(session, *args, **kwargs):
+    from utils.ses import send_project_resourcing_email
     project = get_project_by_id(session, kwargs['project_id'])
     resourcing = session.query(ProjectResourcingModel).filter_by(project_id=kwargs['project_id']).scalar()
     if not resourcing:
@@ -83,7 +91,7 @@ def add_project_resourcing(session, *args, **kwargs):
         project_id=kwargs['project_id']
     ).delete()
 
-    for member_id in kwargs['member_ids']:
+    for member_id in set(kwargs['member_ids']):
         session.add(ProjectTeamMemberModel(project_id=kwargs['project_id'], member_id=member_id))
         session.flush()
 
@@ -194,14 +202,49 @@ def add_project_candidates(session, project_ids, freelancer_id, stage="Longlist"
             session.add(pc)
             session.flush()
         candidates.append(pc)
-    try:
-        from utils.index import insert_freelancer
-        insert_freelancer(freelancer_id)
-    except:
-        print("failted to re index {}".format(freelancer_id))
+    queue_freelancer_reindex(session, freelancer_id)
     return candidates
 
 
+def get_missing_project_ids(session, project_ids):
+    found = {pid for (pid,) in session.query(MasterProjectModel.id).filter(MasterProjectModel.id.in_(project_ids)).all()}
+    return [pid for pid in project_ids if pid not in found]
+
+
+def bulk_add_project_candidates(session, project_ids, freelancer_ids, stage="Longlist"):
+    from freelancer_new.services import change_freelancer_status
+    project_ids = list(dict.fromkeys(project_ids))
+    freelancer_ids = list(dict.fromkeys(freelancer_ids))
+    if not project_ids or not freelancer_ids:
+        return []
+    missing = get_missing_project_ids(session, project_ids)
+    if missing:
+        raise InvalidRequest("Project ids {} not found".format(missing))
+    found = {fid for (fid,) in session.query(FreelancerModel.id).filter(FreelancerModel.id.in_(freelancer_ids)).all()}
+    missing = [fid for fid in freelancer_ids if fid not in found]
+    if missing:
+        raise InvalidRequest("Freelancer ids {} not found".format(missing))
+
+    now = datetime.datetime.utcnow()
+    rows = [
+        dict(project_id=project_id, freelancer_id=freelancer_id, stage=stage, rejected=False, added_on=now)
+        for project_id in project_ids for freelancer_id in freelancer_ids
+    ]
+    # needs uq_project_candidate_map_project_freelancer, built by migrations.upgrade
+    stmt = insert(ProjectCandidateMapModel.__table__).values(rows).on_conflict_do_nothing(
+        index_elements=['project_id', 'freelancer_id']
+    ).returning(ProjectCandidateMapModel.id, ProjectCandidateMapModel.freelancer_id)
+    created = session.execute(stmt).fetchall()
+    created_ids = [r[0] for r in created]
+
+    # a freelancer whose rows all existed already was accepted when they were first added
+    for freelancer_id in dict.fromkeys(r[1] for r in created):
+        change_freelancer_status(session, freelancer_id, "Accepted")
+    session.flush()
+    queue_freelancer_reindex(session, *freelancer_ids)
+    return get_candidates_with_id(session, created_ids) if created_ids else []
+
+
 def reject_project_candidate(session, candidate_ids):
     candidates = get_candidates_with_id(session, candidate_ids)
     for candidate in candidates:
@@ -210,24 +253,48 @@ def reject_project_candidate(session, candidate_ids):
 
 
 def edit_project_candidate(session, candidate_id, **kwargs):
-    candidates = get_candidates_with_id(session, [candidate_id])
+    candidate_ids = candidate_id if isinstance(candidate_id, (list, tuple)) else [candidate_id]
+    candidates = get_candidates_with_id(session, candidate_ids)
     if not candidates:
         raise InvalidRequest("candidate id doesnt exist")
+    freelancer_ids = {c.freelancer_id for c in candidates}
     for candidate in candidates:
         for key, val in kwargs.items():
             setattr(candidate, key, val)
-            freelancer = session.query(FreelancerModel).filter_by(id=candidate.freelancer_id).first()
-            if kwargs['stage'] == "Longlist":
-                freelancer.interview_status = "Pending"
-        try:
-            from utils.index import insert_freelancer
-            insert_freelancer(candidate.freelancer_id)
-        except:
-            print("failted to re index {}".format(candidate.freelancer_id))
-
+    if kwargs.get('stage') == "Longlist" and freelancer_ids:
+        session.query(FreelancerModel).filter(FreelancerModel.id.in_(freelancer_ids)).update(
+            {FreelancerModel.interview_status: "Pending"}, synchronize_session=False
+        )
+    queue_freelancer_reindex(session, *freelancer_ids)
     session.flush()
 
 
+REMOVED_STAGE = "Remove from project"
+
+
+def bulk_transition_candidates(session, candidate_ids, stage, project_id=None):
+    candidate_ids = list(set(candidate_ids))
+    if stage != REMOVED_STAGE and not session.query(StageModel.id).filter_by(template_id=1, name=stage).first():
+        raise InvalidRequest("Invalid stage {}".format(stage))
+    if not candidate_ids:
+        return 0, 0
+    table = ProjectCandidateMapModel.__table__
+    stmt = table.update().where(table.c.id.in_(candidate_ids))
+    if project_id is not None:
+        stmt = stmt.where(table.c.project_id == project_id)
+    # bulk UPDATE skips the mapper events, so the normalised rate is left as is, which is fine as only stage changes
+    rows = session.execute(stmt.values(stage=stage).returning(table.c.freelancer_id)).fetchall()
+    freelancer_ids = {r[0] for r in rows if r[0]}
+    # only a Longlist move writes to freelancers, every other stage updates none of them
+    updated_freelancers = 0
+    if stage == "Longlist" and freelancer_ids:
+        updated_freelancers = session.query(FreelancerModel).filter(FreelancerModel.id.in_(freelancer_ids)).update(
+            {FreelancerModel.interview_status: "Pending"}, synchronize_session=False
+        )
+    queue_freelancer_reindex(session, *freelancer_ids)
+    return len(rows), updated_freelancers
+
+
 def update_project_settings(session, project_id, hiring_stage_id):
     project = get_project_by_id(session, project_id)
     project.hiring_stage_id = hiring_stage_id
@@ -242,6 +309,28 @@ def get_candidates_for_freelancer(session, freelancer_id):
     return session.query(ProjectCandidateMapModel).filter_by(freelancer_id=freelancer_id).all()
 
 
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def get_projects_for_freelancer(session, freelancer_id, q=None, start=0, limit=None, columns=PROJECT_SMALL_COLUMNS):
+    query = session.query(
+        *project_columns(columns),
+        ProjectCandidateMapModel.id.label('candidate_id'), ProjectCandidateMapModel.stage
+    ).outerjoin(ProjectCandidateMapModel, and_(
+        ProjectCandidateMapModel.project_id == MasterProjectModel.id,
+        ProjectCandidateMapModel.freelancer_id == freelancer_id
+    ))
+    if q:
+        query = query.filter(MasterProjectModel.name.ilike("%{}%".format(escape_like(q)), escape="\\"))
+    query = query.order_by(
+        MasterProjectModel.created_at.desc().nullslast(), MasterProjectModel.id.desc()
+    ).offset(start)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
 def set_project_scales(session, project_id, scale_ids):
     session.query(ProjectScaleMapModel).filter_by(
         project_id=project_id
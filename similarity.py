@@ -0,0 +1,197 @@
+import re
+import time
+import struct
+import hashlib
+import threading
+import numpy as np
+from sqlalchemy import func
+from .models import MasterProjectModel, MasterProjectAttributeMap
+
+
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# same cadence as matching.get_engine, each worker process keeps its own index current from the database
+REFRESH_SECONDS = 30
+REBUILD_SECONDS = 6 * 3600
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'will', 'have', 'has', 'our', 'their', 'they',
+    'into', 'who', 'which', 'would', 'should', 'can', 'all', 'any', 'not', 'but', 'also', 'been', 'was', 'were',
+}
+
+
+def token_hash(token):
+    return struct.unpack('<I', hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest())[0]
+
+
+def text_shingles(text):
+    words = [w for w in WORD_RE.findall((text or "").lower()) if len(w) > 2 and w not in STOPWORDS]
+    return {" ".join(words[i:i + 2]) for i in range(len(words) - 1)} | set(words)
+
+
+def project_tokens(project, attrs):
+    tokens = {"{}:{}".format(map_name, map_id) for map_name, map_id in attrs}
+    tokens |= text_shingles(project.background)
+    tokens |= text_shingles(project.notes)
+    return tokens
+
+
+class MinHasher(object):
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, tokens):
+        if not tokens:
+            return None
+        hashes = np.fromiter((token_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+        # universal hashing (a * x + b) mod p, the uint64 product may wrap which is fine for minhash
+        phv = (np.outer(hashes, self.a) + self.b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+        return phv.min(axis=0)
+
+
+class LSHIndex(object):
+    def __init__(self, bands=BANDS, rows=ROWS_PER_BAND):
+        self.bands = bands
+        self.rows = rows
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+        self.lock = threading.RLock()
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def remove(self, key):
+        with self.lock:
+            signature = self.signatures.pop(key, None)
+            if signature is None:
+                return
+            for band, band_key in zip(self.buckets, self.band_keys(signature)):
+                members = band.get(band_key)
+                if members:
+                    members.discard(key)
+                    if not members:
+                        del band[band_key]
+
+    def insert(self, key, signature):
+        with self.lock:
+            self.remove(key)
+            if signature is None:
+                return
+            self.signatures[key] = signature
+            for band, band_key in zip(self.buckets, self.band_keys(signature)):
+                band.setdefault(band_key, set()).add(key)
+
+    def query(self, key, k=10):
+        with self.lock:
+            signature = self.signatures.get(key)
+            if signature is None:
+                return []
+            candidates = set()
+            for band, band_key in zip(self.buckets, self.band_keys(signature)):
+                candidates |= band.get(band_key, set())
+            candidates.discard(key)
+            scored = [(c, float(np.mean(self.signatures[c] == signature))) for c in candidates]
+        scored.sort(key=lambda x: (-x[1], -x[0]))
+        return scored[:k]
+
+
+class SimilarProjectIndex(object):
+    def __init__(self):
+        self.hasher = MinHasher()
+        self.lsh = LSHIndex()
+        self.modified_since = None
+        self.built_at = self.checked_at = 0.0
+
+    def load(self, session, project_ids=None):
+        attrs = session.query(
+            MasterProjectAttributeMap.project_id, MasterProjectAttributeMap.map_name, MasterProjectAttributeMap.map_id
+        )
+        projects = session.query(MasterProjectModel.id, MasterProjectModel.background, MasterProjectModel.notes)
+        if project_ids is not None:
+            attrs = attrs.filter(MasterProjectAttributeMap.project_id.in_(project_ids))
+            projects = projects.filter(MasterProjectModel.id.in_(project_ids))
+        attr_map = {}
+        for project_id, map_name, map_id in attrs:
+            attr_map.setdefault(project_id, []).append((map_name, map_id))
+        for project in projects.yield_per(1000):
+            tokens = project_tokens(project, attr_map.get(project.id, []))
+            self.lsh.insert(project.id, self.hasher.signature(tokens))
+
+    def similar_projects(self, project_id, k=10):
+        return self.lsh.query(project_id, k)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def modified_watermark(session):
+    # modified_at is bumped for attribute writes too, see migrations.TRIGGERS
+    return session.query(func.max(MasterProjectModel.modified_at)).scalar()
+
+
+def build_index(session):
+    index = SimilarProjectIndex()
+    index.modified_since = modified_watermark(session)
+    index.load(session)
+    index.built_at = index.checked_at = time.monotonic()
+    return index
+
+
+def refresh_index(index, session):
+    # projects added, edited or deleted through other workers, same watermark walk as matching.refresh_engine
+    from .delta_index import SAFETY_WINDOW, changed_project_ids, deleted_project_ids
+    since = index.modified_since
+    index.modified_since = modified_watermark(session)
+    index.checked_at = time.monotonic()
+    if since is None:
+        return
+    since = since - SAFETY_WINDOW
+    changed = changed_project_ids(session, since)
+    if changed:
+        index.load(session, changed)
+    for project_id in deleted_project_ids(session, since):
+        index.lsh.remove(project_id)
+
+
+def get_index():
+    global _index
+    index = _index
+    now = time.monotonic()
+    if index is not None and now - index.checked_at < REFRESH_SECONDS:
+        return index
+    with _index_lock:
+        if _index is None or now - _index.built_at > REBUILD_SECONDS:
+            from .routing import get_session
+            session = get_session()
+            _index = build_index(session)
+            session.close()
+        elif now - _index.checked_at >= REFRESH_SECONDS:
+            from .routing import get_session
+            session = get_session()
+            refresh_index(_index, session)
+            session.close()
+    return _index
+
+
+def similar_projects(project_id, k=10):
+    return get_index().similar_projects(project_id, k)
+
+
+def index_project_signature(session, project_id):
+    # keeps this worker's index current right away, the others pick the write up in refresh_index
+    if _index is not None:
+        _index.load(session, [project_id])
+
+
+def remove_project_signature(project_id):
+    if _index is not None:
+        _index.lsh.remove(project_id)
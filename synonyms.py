@@ -0,0 +1,204 @@
+import time
+import threading
+from elasticsearch import TransportError
+from utils.es_conn import es
+from utils.exceptions import InvalidRequest
+from .models import ProjectSynonymModel
+
+
+PROJECT_INDEX = 'project'
+
+
+def analysis_settings(synonyms):
+    # synonyms only apply at search time, the indexed terms never depend on them
+    return {
+        "analysis": {
+            "analyzer": {
+                "default": {
+                    "tokenizer": "whitespace",
+                    "filter": ["lowercase"]
+                },
+                "default_search": {
+                    "tokenizer": "whitespace",
+                    "filter": ["lowercase", "synonym"]
+                }
+            },
+            "filter": synonym_filter(synonyms)
+        }
+    }
+
+
+def synonym_filter(synonyms):
+    return {
+        "synonym": {
+            "type": "synonym_graph",
+            "synonyms": list(synonyms)
+        }
+    }
+
+
+def clean_rule(rule):
+    rule = " ".join(str(rule).lower().split())
+    if not rule:
+        return None
+    if "=>" in rule:
+        lhs, _, rhs = rule.partition("=>")
+        terms = [t.strip() for t in lhs.split(",")], [t.strip() for t in rhs.split(",")]
+        if not all(terms[0]) or not all(terms[1]) or "=>" in rhs:
+            raise InvalidRequest("invalid synonym rule {}".format(rule))
+        return "{} => {}".format(", ".join(terms[0]), ", ".join(terms[1]))
+    terms = [t.strip() for t in rule.split(",")]
+    if len(terms) < 2 or not all(terms):
+        raise InvalidRequest("synonym rule {} needs at least two comma separated terms".format(rule))
+    return ", ".join(terms)
+
+
+def rejected_rules(rules):
+    def parses(rules):
+        try:
+            es.indices.analyze(body={
+                "tokenizer": "whitespace",
+                "filter": ["lowercase", dict(synonym_filter(rules)["synonym"])],
+                "text": "synonym check"
+            })
+        except TransportError as e:
+            if e.status_code != 400:
+                raise
+            return False
+        return True
+    if not rules or parses(rules):
+        return []
+    return [rule for rule in rules if not parses([rule])]
+
+
+def get_synonyms(session):
+    # the defaults are seeded with the table (migrations.TABLES), an empty list means the rules were cleared
+    return [s.rule for s in session.query(ProjectSynonymModel).order_by(ProjectSynonymModel.id).all()]
+
+
+def set_synonyms(session, rules):
+    cleaned = []
+    for rule in rules:
+        rule = clean_rule(rule)
+        if rule and rule not in cleaned:
+            cleaned.append(rule)
+    # the index is built without lenient, a rule elasticsearch cannot parse would fail the reload
+    rejected = rejected_rules(cleaned)
+    if rejected:
+        raise InvalidRequest("invalid synonym rules {}".format(rejected))
+    session.query(ProjectSynonymModel).delete()
+    for rule in cleaned:
+        session.add(ProjectSynonymModel(rule=rule))
+    session.flush()
+    return cleaned
+
+
+def alias_targets(index=PROJECT_INDEX):
+    if not es.indices.exists_alias(name=index):
+        return []
+    return list(es.indices.get_alias(name=index))
+
+
+def create_versioned_index(synonyms, mappings=None, index=PROJECT_INDEX):
+    # "project" is an alias over project_<ms>, a rebuild fills a new one and swaps the alias once it is complete
+    target = "{}_{}".format(index, int(time.time() * 1000))
+    body = {"settings": analysis_settings(synonyms)}
+    if mappings:
+        body["mappings"] = mappings
+    es.indices.create(target, body=body)
+    return target
+
+
+def swap_alias(target, index=PROJECT_INDEX):
+    sources = alias_targets(index)
+    if sources:
+        es.indices.update_aliases(body={"actions": [
+            {"remove": {"index": source, "alias": index}} for source in sources
+        ] + [{"add": {"index": target, "alias": index}}]})
+        es.indices.delete(",".join(sources))
+    else:
+        if es.indices.exists(index):
+            # a concrete index from before the alias existed, its name has to go before it can become one
+            es.indices.delete(index)
+        es.indices.put_alias(index=target, name=index)
+
+
+def catch_up(session, started_at):
+    # writes that landed on the old index while the new one was filled
+    from .delta_index import SAFETY_WINDOW, changed_project_ids, deleted_project_ids, remove_project_docs
+    from .serializers import index_all_projects
+    from .models import MasterProjectModel
+    since = started_at - SAFETY_WINDOW
+    changed = changed_project_ids(session, since)
+    if changed:
+        index_all_projects(
+            session.query(MasterProjectModel).filter(MasterProjectModel.id.in_(changed)).all(), keep_index=True
+        )
+    remove_project_docs(deleted_project_ids(session, since))
+
+
+def applied_synonyms(index=PROJECT_INDEX):
+    for settings in es.indices.get_settings(index=index).values():
+        analysis = settings["settings"]["index"].get("analysis", {})
+        return analysis.get("filter", {}).get("synonym", {}).get("synonyms", [])
+    return []
+
+
+def reload_synonyms(index=PROJECT_INDEX):
+    # copies every doc into an index built with the current rules, run it from the worker or the command below
+    # and never inside a request
+    from .delta_index import db_now
+    from .routing import get_write_session
+    if not es.indices.exists(index):
+        return False
+    session = get_write_session()
+    synonyms = get_synonyms(session)
+    if applied_synonyms(index) == synonyms:
+        session.close()
+        return False
+    started_at = db_now(session)
+    source = (alias_targets(index) or [index])[0]
+    target = create_versioned_index(synonyms, es.indices.get_mapping(index=source)[source]["mappings"], index)
+    es.reindex(
+        body={"source": {"index": index}, "dest": {"index": target}}, wait_for_completion=True, request_timeout=3600
+    )
+    swap_alias(target, index)
+    catch_up(session, started_at)
+    session.close()
+    print("synonyms reloaded into {}".format(target))
+    return True
+
+
+class SynonymReloadWorker(object):
+    # one reload at a time, edits that arrive while it runs are picked up by one more pass. the rules live in
+    # the database, so a reload lost with the process is redone by the next edit or by running this module
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = False
+        self.thread = None
+
+    def submit(self):
+        with self.lock:
+            self.pending = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="synonym-reload", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+                self.pending = False
+            try:
+                reload_synonyms()
+            except Exception as e:
+                print("synonym reload failed", e)
+
+
+reload_worker = SynonymReloadWorker()
+
+
+if __name__ == "__main__":
+    reload_synonyms()
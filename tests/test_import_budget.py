@@ -0,0 +1,13 @@
+import unittest
+from ..import_budget import LIGHT_MODULES, IMPORT_BUDGET_US, check_import_budget
+
+
+class ImportBudgetTest(unittest.TestCase):
+    def test_light_modules_within_budget(self):
+        # fails when models/services/indexing start pulling in the GraphQL or email stack, or get slow to import
+        problems = check_import_budget(LIGHT_MODULES, IMPORT_BUDGET_US)
+        self.assertEqual(problems, [], "\n".join(problems))
+
+
+if __name__ == "__main__":
+    unittest.main()
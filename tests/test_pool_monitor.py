@@ -0,0 +1,71 @@
+import unittest
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from ..pool_monitor import PoolMonitor, SessionLeakError, TimedQueuePool, fail_on_leak
+
+
+class FailOnLeakTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=QueuePool)
+        self.Session = sessionmaker(bind=self.engine)
+        self.monitor = PoolMonitor(self.engine).install()
+
+    def tearDown(self):
+        self.monitor.uninstall()
+        self.engine.dispose()
+
+    def test_closed_session_passes(self):
+        with fail_on_leak(self.monitor):
+            session = self.Session()
+            session.execute(text("SELECT 1"))
+            session.close()
+        self.assertEqual(self.monitor.stats()["open_sessions"], 0)
+
+    def test_open_session_raises(self):
+        session = self.Session()
+        with self.assertRaises(SessionLeakError):
+            with fail_on_leak(self.monitor):
+                session.execute(text("SELECT 1"))
+        session.close()
+
+    def test_committed_session_passes(self):
+        # commit hands the connection back, the session itself holds nothing until it is used again
+        with fail_on_leak(self.monitor):
+            session = self.Session()
+            session.execute(text("SELECT 1"))
+            session.commit()
+
+    def test_checked_out_connection_raises(self):
+        with self.assertRaises(SessionLeakError):
+            with fail_on_leak(self.monitor):
+                conn = self.engine.connect()
+        conn.close()
+
+    def test_requires_a_monitor(self):
+        with self.assertRaises(RuntimeError):
+            with fail_on_leak(None):
+                pass
+
+
+class CheckoutWaitTest(unittest.TestCase):
+    def test_waits_and_timeouts_are_counted(self):
+        engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05)
+        monitor = PoolMonitor(engine).install()
+        try:
+            held = engine.connect()
+            with self.assertRaises(exc.TimeoutError):
+                engine.connect()
+            held.close()
+            engine.connect().close()
+            stats = monitor.stats()
+            self.assertEqual(stats["timeouts"], 1)
+            self.assertEqual(stats["wait_count"], 3)
+            self.assertGreaterEqual(stats["wait_max"], 0.05)
+        finally:
+            monitor.uninstall()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import unittest
+from sqlalchemy import create_engine
+from ..migrations import upgrade, check_query_plans
+
+
+# a scratch postgres database, the schema is migrated in place
+DATABASE_URL = os.environ.get("PROJECT_TEST_DATABASE_URL")
+
+
+@unittest.skipUnless(DATABASE_URL, "PROJECT_TEST_DATABASE_URL is not set")
+class QueryPlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine(DATABASE_URL)
+        upgrade(cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def test_hot_queries_use_indexes(self):
+        failures = check_query_plans(self.engine)
+        self.assertEqual(failures, [], "\n\n".join("{}:\n{}".format(name, plan) for name, plan in failures))
+
+
+if __name__ == "__main__":
+    unittest.main()